@@ -1,3 +1,4 @@
+from functools import lru_cache
 from pydantic_settings import BaseSettings
 from typing import Optional
 
@@ -29,6 +30,7 @@ class Settings(BaseSettings):
     class Config:
         env_file = ".env"
 
+@lru_cache(maxsize=1)
 def get_settings() -> Settings:
     return Settings()
 
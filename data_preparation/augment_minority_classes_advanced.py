@@ -5,9 +5,12 @@
 """
 
 import os
-import random
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 import cv2
 import numpy as np
 
@@ -27,6 +30,38 @@ BLUR_KERNEL_RANGE = (3, 7)
 NOISE_RANGE = (0, 15)
 ZOOM_RANGE = (0.9, 1.1)  # Zoom in/out 90%-110%
 
+# Сколько равномерных чисел нужно augment_image на одну копию
+# (все решения вытягиваются заранее одним вызовом генератора)
+N_RANDOM_DRAWS = 21
+
+# Конвейер чтение → аугментация → запись
+PREFETCH_SIZE = 32  # Максимум изображений в очереди на каждой стадии
+WRITER_THREADS = 4
+
+# Параметры кодирования: аугментированные копии - обучающие данные, а не архив,
+# поэтому JPEG q=88 (вместо 95 по умолчанию) и самое быстрое сжатие PNG
+IMWRITE_PARAMS = {
+    '.jpg': [cv2.IMWRITE_JPEG_QUALITY, 88, cv2.IMWRITE_JPEG_PROGRESSIVE, 0],
+    '.jpeg': [cv2.IMWRITE_JPEG_QUALITY, 88, cv2.IMWRITE_JPEG_PROGRESSIVE, 0],
+    '.png': [cv2.IMWRITE_PNG_COMPRESSION, 1],
+}
+
+# Ядра фильтров считаются один раз при загрузке модуля
+BLUR_KERNELS = (3, 5, 7)
+GAUSS_KERNELS = {k: cv2.getGaussianKernel(k, 0) for k in BLUR_KERNELS}
+# BGR <-> YIQ для изменения оттенка и насыщенности без HSV
+BGR_TO_YIQ = np.array([[0.299, 0.587, 0.114],
+                       [0.596, -0.274, -0.322],
+                       [0.211, -0.523, 0.312]])[:, ::-1]
+YIQ_TO_BGR = np.linalg.inv(BGR_TO_YIQ)
+
+# Ширина мягкого края тени (sigma, эквивалентная GaussianBlur 51x51)
+SHADOW_EDGE_SIGMA = 8.0
+
+SHARPEN_KERNEL = np.array([[-1, -1, -1],
+                           [-1,  9, -1],
+                           [-1, -1, -1]], dtype=np.float32)
+
 
 def read_yolo_label(label_path: Path) -> List[Tuple[int, float, float, float, float]]:
     """Читает YOLO label файл"""
@@ -48,72 +83,162 @@ def read_yolo_label(label_path: Path) -> List[Tuple[int, float, float, float, fl
 
 
 def write_yolo_label(label_path: Path, boxes: List[Tuple[int, float, float, float, float]]):
-    """Записывает YOLO label файл с клипингом координат"""
+    """Записывает YOLO label файл с клипингом координат (одной записью)"""
+    lines = []
+    for box in boxes:
+        class_id, x_center, y_center, width, height = box
+        # Клипинг до [0, 1]
+        x_center = max(0.0, min(1.0, x_center))
+        y_center = max(0.0, min(1.0, y_center))
+        width = max(0.0, min(1.0, width))
+        height = max(0.0, min(1.0, height))
+        lines.append(f"{class_id} {x_center:.6f} {y_center:.6f} {width:.6f} {height:.6f}\n")
+
     with open(label_path, 'w') as f:
-        for box in boxes:
-            class_id, x_center, y_center, width, height = box
-            # Клипинг до [0, 1]
-            x_center = max(0.0, min(1.0, x_center))
-            y_center = max(0.0, min(1.0, y_center))
-            width = max(0.0, min(1.0, width))
-            height = max(0.0, min(1.0, height))
-            f.write(f"{class_id} {x_center:.6f} {y_center:.6f} {width:.6f} {height:.6f}\n")
-
-
-def rotate_image_and_boxes(image: np.ndarray, boxes: List[Tuple], angle: float) -> Tuple[np.ndarray, List[Tuple]]:
-    """Поворот изображения и bbox"""
+        f.write(''.join(lines))
+
+
+def affine_image_and_boxes(
+    image: np.ndarray,
+    boxes: List[Tuple],
+    angle: float = 0.0,
+    zoom: float = 1.0,
+    flip_h: bool = False,
+    flip_v: bool = False
+) -> Tuple[np.ndarray, List[Tuple]]:
+    """
+    Поворот, zoom и отражения одной аффинной матрицей
+
+    Все геометрические трансформации собираются в одну матрицу 3x3,
+    поэтому изображение интерполируется один раз (один warpAffine)
+    вместо отдельного прохода на каждую трансформацию. Та же матрица
+    применяется к углам bbox (transform_boxes).
+    """
+    if angle == 0.0 and zoom == 1.0 and not flip_h and not flip_v:
+        return image, boxes
+
     h, w = image.shape[:2]
     center = (w // 2, h // 2)
 
-    M = cv2.getRotationMatrix2D(center, angle, 1.0)
-    rotated = cv2.warpAffine(image, M, (w, h), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REFLECT)
+    # Поворот + zoom вокруг центра
+    M = np.vstack([cv2.getRotationMatrix2D(center, angle, zoom), [0.0, 0.0, 1.0]])
 
-    return rotated, boxes
+    if flip_h:
+        M = np.array([[-1.0, 0.0, w - 1], [0.0, 1.0, 0.0], [0.0, 0.0, 1.0]]) @ M
+    if flip_v:
+        M = np.array([[1.0, 0.0, 0.0], [0.0, -1.0, h - 1], [0.0, 0.0, 1.0]]) @ M
 
+    transformed = cv2.warpAffine(image, M[:2], (w, h), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REFLECT)
 
-def adjust_brightness_contrast(image: np.ndarray, brightness: float, contrast: float) -> np.ndarray:
-    """Яркость и контраст"""
-    img = cv2.convertScaleAbs(image, alpha=contrast, beta=0)
-    img = cv2.convertScaleAbs(img, alpha=brightness, beta=0)
-    return img
+    return transformed, transform_boxes(boxes, M, w, h)
 
 
-def adjust_hsv(image: np.ndarray, saturation: float, hue_shift: int) -> np.ndarray:
-    """Изменение HSV (насыщенность и оттенок)"""
-    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV).astype(np.float32)
+def transform_boxes(boxes: List[Tuple], M: np.ndarray, w: int, h: int) -> List[Tuple]:
+    """
+    Пересчёт YOLO bbox через аффинную матрицу M (3x3, в пикселях)
+
+    Все 4 угла всех bbox преобразуются одним матричным умножением,
+    новый bbox - описанный прямоугольник, обрезанный по границам кадра.
+    Bbox, целиком ушедшие за кадр, отбрасываются.
+
+    M задана, как для warpAffine, в координатах центров пикселей (центр
+    пикселя i - точка i), а углы bbox лежат на границах пикселей (0..w),
+    поэтому перед умножением углы сдвигаются на -0.5 и после - обратно.
+    """
+    if not boxes:
+        return boxes
+
+    arr = np.array(boxes, dtype=np.float64)
+    class_ids = arr[:, 0].astype(int)
+    cx, cy = arr[:, 1] * w, arr[:, 2] * h
+    half_w, half_h = arr[:, 3] * w / 2, arr[:, 4] * h / 2
+
+    x1, y1, x2, y2 = cx - half_w, cy - half_h, cx + half_w, cy + half_h
+    corners = np.stack([
+        np.stack([x1, y1], axis=-1),
+        np.stack([x2, y1], axis=-1),
+        np.stack([x2, y2], axis=-1),
+        np.stack([x1, y2], axis=-1),
+    ], axis=1) - 0.5  # (N, 4, 2), в координатах центров пикселей
+
+    corners_h = np.concatenate([corners, np.ones(corners.shape[:2] + (1,))], axis=-1)
+    moved = corners_h @ M[:2].T + 0.5  # (N, 4, 2), снова границы пикселей
+
+    lower = np.clip(moved.min(axis=1), 0, [w, h])
+    upper = np.clip(moved.max(axis=1), 0, [w, h])
+    size = upper - lower
+    center = (lower + upper) / 2
+
+    new_boxes = []
+    for class_id, (x_c, y_c), (b_w, b_h) in zip(class_ids.tolist(), center.tolist(), size.tolist()):
+        if b_w <= 0 or b_h <= 0:
+            continue
+        new_boxes.append((class_id, x_c / w, y_c / h, b_w / w, b_h / h))
 
-    # Saturation
-    hsv[:, :, 1] = np.clip(hsv[:, :, 1] * saturation, 0, 255)
+    return new_boxes
 
-    # Hue shift
-    hsv[:, :, 0] = (hsv[:, :, 0] + hue_shift) % 180
 
-    return cv2.cvtColor(hsv.astype(np.uint8), cv2.COLOR_HSV2BGR)
+def adjust_brightness_contrast(image: np.ndarray, brightness: float, contrast: float) -> np.ndarray:
+    """Яркость и контраст (одна LUT-таблица вместо двух проходов по изображению)"""
+    lut = np.clip(np.rint(np.arange(256) * (contrast * brightness)), 0, 255).astype(np.uint8)
+    return cv2.LUT(image, lut)
+
+
+def adjust_hsv(image: np.ndarray, saturation: float, hue_shift: int) -> np.ndarray:
+    """
+    Изменение насыщенности и оттенка без перехода BGR → HSV → BGR
+
+    В YIQ яркость Y не зависит от цвета, оттенок - угол в плоскости (I, Q),
+    насыщенность - длина вектора (I, Q). Поэтому поворот на hue_shift и
+    масштаб на saturation собираются в одну матрицу 3x3 для BGR и
+    применяются одним проходом cv2.transform в uint8.
+    """
+    # H в OpenCV: 1 единица = 2°. Рост H (красный → жёлтый) в плоскости (I, Q)
+    # идёт по часовой стрелке, поэтому угол поворота берётся со знаком минус
+    theta = -np.deg2rad(hue_shift * 2)
+    cos_t = saturation * np.cos(theta)
+    sin_t = saturation * np.sin(theta)
+
+    iq_transform = np.array([[1.0, 0.0, 0.0],
+                             [0.0, cos_t, -sin_t],
+                             [0.0, sin_t, cos_t]])
+    matrix = (YIQ_TO_BGR @ iq_transform @ BGR_TO_YIQ).astype(np.float32)
+    return cv2.transform(image, matrix)
 
 
 def add_blur(image: np.ndarray, kernel_size: int) -> np.ndarray:
     """Размытие"""
     if kernel_size % 2 == 0:
         kernel_size += 1
-    return cv2.GaussianBlur(image, (kernel_size, kernel_size), 0)
+    kernel = GAUSS_KERNELS.get(kernel_size)
+    if kernel is None:
+        kernel = cv2.getGaussianKernel(kernel_size, 0)
+    return cv2.sepFilter2D(image, -1, kernel, kernel)
 
 
 def add_sharpen(image: np.ndarray) -> np.ndarray:
     """Повышение резкости"""
-    kernel = np.array([[-1, -1, -1],
-                       [-1,  9, -1],
-                       [-1, -1, -1]])
-    return cv2.filter2D(image, -1, kernel)
+    return cv2.filter2D(image, -1, SHARPEN_KERNEL)
+
+
+# Буфер шума переиспользуется между вызовами add_noise
+# (пересоздаётся только при смене размера изображения)
+_noise_buffer = None
 
 
 def add_noise(image: np.ndarray, noise_level: float) -> np.ndarray:
     """Гауссов шум"""
+    global _noise_buffer
+
     if noise_level == 0:
         return image
 
-    noise = np.random.normal(0, noise_level, image.shape).astype(np.int16)
-    noisy = np.clip(image.astype(np.int16) + noise, 0, 255).astype(np.uint8)
-    return noisy
+    if _noise_buffer is None or _noise_buffer.shape != image.shape:
+        _noise_buffer = np.empty(image.shape, dtype=np.int16)
+
+    # Шум генерируется сразу в int16, сложение с насыщением в uint8 за один проход
+    cv2.randn(_noise_buffer.reshape(image.shape[0], -1), 0, noise_level)
+    return cv2.add(image, _noise_buffer, dtype=cv2.CV_8U)
 
 
 def apply_clahe(image: np.ndarray) -> np.ndarray:
@@ -124,146 +249,126 @@ def apply_clahe(image: np.ndarray) -> np.ndarray:
     return cv2.cvtColor(lab, cv2.COLOR_LAB2BGR)
 
 
-def zoom_image_and_boxes(image: np.ndarray, boxes: List[Tuple], zoom: float) -> Tuple[np.ndarray, List[Tuple]]:
-    """Zoom in/out с корректировкой bbox"""
-    h, w = image.shape[:2]
-
-    if zoom == 1.0:
-        return image, boxes
-
-    # Вычисляем новый размер
-    new_h = int(h / zoom)
-    new_w = int(w / zoom)
-
-    # Crop центр
-    y1 = (h - new_h) // 2
-    x1 = (w - new_w) // 2
-    y2 = y1 + new_h
-    x2 = x1 + new_w
-
-    cropped = image[y1:y2, x1:x2]
-
-    # Resize обратно к оригинальному размеру
-    zoomed = cv2.resize(cropped, (w, h), interpolation=cv2.INTER_LINEAR)
+def uniform(u: float, low: float, high: float) -> float:
+    """Аналог random.uniform для заранее вытянутого u из [0, 1)"""
+    return low + u * (high - low)
 
-    # Bbox остаются относительно центра, поэтому не трогаем
-    return zoomed, boxes
 
+def uniform_int(u: float, low: int, high: int) -> int:
+    """Аналог random.randint (границы включительно) для заранее вытянутого u из [0, 1)"""
+    return low + int(u * (high - low + 1))
 
-def flip_horizontal(image: np.ndarray, boxes: List[Tuple]) -> Tuple[np.ndarray, List[Tuple]]:
-    """Горизонтальное отражение"""
-    flipped_img = cv2.flip(image, 1)
 
-    flipped_boxes = []
-    for class_id, x_center, y_center, width, height in boxes:
-        new_x_center = 1.0 - x_center
-        flipped_boxes.append((class_id, new_x_center, y_center, width, height))
-
-    return flipped_img, flipped_boxes
-
-
-def flip_vertical(image: np.ndarray, boxes: List[Tuple]) -> Tuple[np.ndarray, List[Tuple]]:
-    """Вертикальное отражение"""
-    flipped_img = cv2.flip(image, 0)
-
-    flipped_boxes = []
-    for class_id, x_center, y_center, width, height in boxes:
-        new_y_center = 1.0 - y_center
-        flipped_boxes.append((class_id, x_center, new_y_center, width, height))
-
-    return flipped_img, flipped_boxes
-
-
-def add_shadow(image: np.ndarray) -> np.ndarray:
-    """Добавляет случайную тень"""
+def add_shadow(image: np.ndarray, u_top: float, u_bottom: float, u_strength: float) -> np.ndarray:
+    """Добавляет случайную тень (u_* - равномерные числа из [0, 1))"""
     h, w = image.shape[:2]
 
     # Случайная тень
-    top_y = random.randint(0, h // 2)
-    bottom_y = random.randint(h // 2, h)
-
-    shadow_mask = np.zeros((h, w), dtype=np.float32)
-    shadow_mask[top_y:bottom_y, :] = random.uniform(0.4, 0.7)
-
-    shadow_mask = cv2.GaussianBlur(shadow_mask, (51, 51), 0)
-
-    shadowed = image.copy().astype(np.float32)
-    shadowed = shadowed * (1 - shadow_mask[:, :, np.newaxis])
-
-    return np.clip(shadowed, 0, 255).astype(np.uint8)
-
-
-def augment_image(image_path: Path, label_path: Path, output_image_path: Path, output_label_path: Path, aug_id: int):
-    """Применяет агрессивную аугментацию"""
-    # Читаем
-    image = cv2.imread(str(image_path))
-    if image is None:
-        return False
-
-    boxes = read_yolo_label(label_path)
+    top_y = uniform_int(u_top, 0, h // 2)
+    bottom_y = uniform_int(u_bottom, h // 2, h)
+
+    alpha = uniform(u_strength, 0.4, 0.7)
+
+    # Тень - горизонтальная полоса, поэтому маска зависит только от y.
+    # Мягкие края задаются аналитически (разность двух сигмоид) по H строкам
+    # вместо GaussianBlur(51x51) по всему кадру.
+    # sigmoid(x) = (1 + tanh(x / 2)) / 2 - без переполнения exp на далёких строках
+    y = np.arange(h, dtype=np.float32)
+    scale = 2 * SHADOW_EDGE_SIGMA / 1.702  # логистическая аппроксимация гауссова края
+    profile = alpha * 0.5 * (np.tanh((y - top_y) / scale) - np.tanh((y - bottom_y) / scale))
+
+    # Доля пропускаемого света в fixed-point uint8 (255 = 1.0),
+    # изображение не копируется и не переводится в float32
+    keep_column = np.rint((1 - profile) * 255).astype(np.uint8).reshape(h, 1)
+    keep = cv2.repeat(keep_column, 1, w * image.shape[2]).reshape(image.shape)
+    return cv2.multiply(image, keep, scale=1 / 255)
+
+
+def augment_image(image: np.ndarray, boxes: List[Tuple], u: np.ndarray) -> Optional[Tuple[np.ndarray, List[Tuple]]]:
+    """
+    Применяет агрессивную аугментацию
+
+    image и boxes уже прочитаны вызывающим кодом (один раз на все копии)
+    и не изменяются. u - строка из N_RANDOM_DRAWS равномерных чисел [0, 1),
+    вытянутых заранее одним вызовом генератора (см. main). Возвращает
+    (изображение, bbox) или None; запись на диск выполняет save_augmented.
+    """
     if not boxes:
-        return False
+        return None
 
-    augmented_img = image.copy()
-    augmented_boxes = boxes.copy()
+    (p_rotate, u_angle, p_flip_h, p_flip_v, p_zoom, u_zoom,
+     u_brightness, u_contrast,
+     p_hsv, u_saturation, u_hue,
+     p_filter, p_blur, u_kernel,
+     p_noise, u_noise,
+     p_clahe,
+     p_shadow, u_shadow_top, u_shadow_bottom, u_shadow_strength) = u.tolist()
 
-    # === НАБОР ТРАНСФОРМАЦИЙ (рандомный выбор) ===
+    # Без копии: каждая трансформация возвращает новый буфер, исходник не меняется
+    augmented_img = image
+    augmented_boxes = boxes
 
-    # 1. Поворот (70% вероятность)
-    if random.random() > 0.3:
-        angle = random.uniform(*ROTATION_RANGE)
-        augmented_img, augmented_boxes = rotate_image_and_boxes(augmented_img, augmented_boxes, angle)
-
-    # 2. Flip горизонтальный (50%)
-    if random.random() > 0.5:
-        augmented_img, augmented_boxes = flip_horizontal(augmented_img, augmented_boxes)
-
-    # 3. Flip вертикальный (20%)
-    if random.random() > 0.8:
-        augmented_img, augmented_boxes = flip_vertical(augmented_img, augmented_boxes)
+    # === НАБОР ТРАНСФОРМАЦИЙ (рандомный выбор) ===
 
-    # 4. Яркость и контраст (всегда)
-    brightness = random.uniform(*BRIGHTNESS_RANGE)
-    contrast = random.uniform(*CONTRAST_RANGE)
+    # 1. Геометрия: поворот (70%), flip горизонтальный (50%),
+    # flip вертикальный (20%), zoom (30%) — одним warpAffine
+    angle = uniform(u_angle, *ROTATION_RANGE) if p_rotate > 0.3 else 0.0
+    flip_h = p_flip_h > 0.5
+    flip_v = p_flip_v > 0.8
+    zoom = uniform(u_zoom, *ZOOM_RANGE) if p_zoom > 0.7 else 1.0
+    augmented_img, augmented_boxes = affine_image_and_boxes(
+        augmented_img, augmented_boxes, angle, zoom, flip_h, flip_v
+    )
+    if not augmented_boxes:
+        return None
+
+    # 2. Яркость и контраст (всегда)
+    brightness = uniform(u_brightness, *BRIGHTNESS_RANGE)
+    contrast = uniform(u_contrast, *CONTRAST_RANGE)
     augmented_img = adjust_brightness_contrast(augmented_img, brightness, contrast)
 
-    # 5. HSV (70%)
-    if random.random() > 0.3:
-        saturation = random.uniform(*SATURATION_RANGE)
-        hue_shift = random.randint(*HUE_SHIFT_RANGE)
+    # 3. HSV (70%)
+    if p_hsv > 0.3:
+        saturation = uniform(u_saturation, *SATURATION_RANGE)
+        hue_shift = uniform_int(u_hue, *HUE_SHIFT_RANGE)
         augmented_img = adjust_hsv(augmented_img, saturation, hue_shift)
 
-    # 6. Blur ИЛИ Sharpen (50%)
-    if random.random() > 0.5:
-        if random.random() > 0.5:
-            kernel_size = random.choice([3, 5, 7])
+    # 4. Blur ИЛИ Sharpen (50%)
+    if p_filter > 0.5:
+        if p_blur > 0.5:
+            kernel_size = BLUR_KERNELS[int(u_kernel * len(BLUR_KERNELS))]
             augmented_img = add_blur(augmented_img, kernel_size)
         else:
             augmented_img = add_sharpen(augmented_img)
 
-    # 7. Noise (30%)
-    if random.random() > 0.7:
-        noise_level = random.uniform(*NOISE_RANGE)
+    # 5. Noise (30%)
+    if p_noise > 0.7:
+        noise_level = uniform(u_noise, *NOISE_RANGE)
         augmented_img = add_noise(augmented_img, noise_level)
 
-    # 8. CLAHE (40%)
-    if random.random() > 0.6:
+    # 6. CLAHE (40%)
+    if p_clahe > 0.6:
         augmented_img = apply_clahe(augmented_img)
 
-    # 9. Zoom (30%)
-    if random.random() > 0.7:
-        zoom = random.uniform(*ZOOM_RANGE)
-        augmented_img, augmented_boxes = zoom_image_and_boxes(augmented_img, augmented_boxes, zoom)
+    # 7. Shadow (20%)
+    if p_shadow > 0.8:
+        augmented_img = add_shadow(augmented_img, u_shadow_top, u_shadow_bottom, u_shadow_strength)
+
+    return augmented_img, augmented_boxes
 
-    # 10. Shadow (20%)
-    if random.random() > 0.8:
-        augmented_img = add_shadow(augmented_img)
 
-    # Сохраняем
-    cv2.imwrite(str(output_image_path), augmented_img)
-    write_yolo_label(output_label_path, augmented_boxes)
+def save_augmented(output_image_path: Path, output_label_path: Path, image: np.ndarray, boxes: List[Tuple]):
+    """Кодирует и сохраняет результат аугментации (выполняется в потоке-писателе)"""
+    params = IMWRITE_PARAMS.get(output_image_path.suffix.lower(), [])
+    cv2.imwrite(str(output_image_path), image, params)
+    write_yolo_label(output_label_path, boxes)
 
-    return True
+
+def read_images(images_to_augment: List[Tuple[Path, List[Tuple]]], read_queue: queue.Queue):
+    """Поток-читатель: декодирует изображения заранее, пока основной поток аугментирует"""
+    for image_path, boxes in images_to_augment:
+        read_queue.put((image_path, cv2.imread(str(image_path)), boxes))
+    read_queue.put(None)
 
 
 def main():
@@ -278,6 +383,7 @@ def main():
     print()
 
     total_created = 0
+    rng = np.random.default_rng()
 
     for split in ['train', 'val', 'test']:
         images_dir = dataset_dir / 'images' / split
@@ -300,7 +406,8 @@ def main():
                 for ext in ['.jpg', '.JPG', '.jpeg', '.png']:
                     image_path = images_dir / f"{image_name}{ext}"
                     if image_path.exists():
-                        images_to_augment.append((image_path, label_file))
+                        # bbox уже разобраны - повторно label не читаем
+                        images_to_augment.append((image_path, boxes))
                         break
 
         print(f"   Найдено: {len(images_to_augment)}")
@@ -311,21 +418,55 @@ def main():
         # Аугментация
         augmented_count = 0
 
-        for image_path, label_path in images_to_augment:
-            base_name = image_path.stem
-            ext = image_path.suffix
+        # Конвейер: чтение/декодирование (поток-читатель) → аугментация
+        # (основной поток) → кодирование/запись (пул писателей).
+        # cv2.imread/imwrite отпускают GIL, поэтому стадии идут параллельно.
+        read_queue = queue.Queue(maxsize=PREFETCH_SIZE)
+        reader = threading.Thread(target=read_images, args=(images_to_augment, read_queue), daemon=True)
+        reader.start()
+
+        pending_writes = deque()
+
+        with ThreadPoolExecutor(max_workers=WRITER_THREADS) as writer:
+            while True:
+                item = read_queue.get()
+                if item is None:
+                    break
 
-            for i in range(AUGMENTATION_FACTOR):
-                aug_name = f"{base_name}_adv{i}"
-                output_image = images_dir / f"{aug_name}{ext}"
-                output_label = labels_dir / f"{aug_name}.txt"
+                image_path, image, boxes = item
+                if image is None:
+                    continue
+
+                base_name = image_path.stem
+                ext = image_path.suffix
+
+                # Все случайные решения для всех копий изображения - одним вызовом (PCG64)
+                draws = rng.random((AUGMENTATION_FACTOR, N_RANDOM_DRAWS))
+
+                for i in range(AUGMENTATION_FACTOR):
+                    result = augment_image(image, boxes, draws[i])
+                    if result is None:
+                        continue
+
+                    aug_name = f"{base_name}_adv{i}"
+                    output_image = images_dir / f"{aug_name}{ext}"
+                    output_label = labels_dir / f"{aug_name}.txt"
+
+                    # Ограничиваем число результатов, ждущих записи, чтобы не копить их в памяти
+                    if len(pending_writes) >= PREFETCH_SIZE:
+                        pending_writes.popleft().result()
+                    pending_writes.append(writer.submit(save_augmented, output_image, output_label, *result))
 
-                if augment_image(image_path, label_path, output_image, output_label, i):
                     augmented_count += 1
 
                     if augmented_count % 100 == 0:
                         print(f"   ✅ {augmented_count}")
 
+            for future in pending_writes:
+                future.result()
+
+        reader.join()
+
         print(f"   ✅ Создано: {augmented_count}\n")
         total_created += augmented_count
 
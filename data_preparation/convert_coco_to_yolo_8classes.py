@@ -2,12 +2,19 @@
 Конвертация COCO формата аннотаций в YOLO формат для 8 классов
 Включает nest и safety_sign
 """
-import json
 import os
 from pathlib import Path
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 import shutil
 
+import ijson
+import numpy as np
+from PIL import Image
+
+import fileops
+
 # 8 категорий (добавили nest и safety_sign)
 TARGET_CATEGORIES = {
     'vibration_damper': 0,
@@ -20,26 +27,33 @@ TARGET_CATEGORIES = {
     'safety_sign+': 7       # НОВЫЙ (в COCO называется safety_sign+)
 }
 
-def convert_bbox_coco_to_yolo(bbox, img_width, img_height):
-    """Конвертация bbox из COCO в YOLO формат"""
-    x, y, w, h = bbox
-    center_x = (x + w / 2) / img_width
-    center_y = (y + h / 2) / img_height
-    norm_w = w / img_width
-    norm_h = h / img_height
-    return [center_x, center_y, norm_w, norm_h]
-
-def load_coco_annotations(coco_path):
-    """Загрузка COCO аннотаций"""
-    with open(coco_path, 'r', encoding='utf-8') as f:
-        coco_data = json.load(f)
-    return coco_data
-
-def create_category_mapping(coco_data):
+YOLO_LINE_FORMAT = "%d %.6f %.6f %.6f %.6f\n"
+
+def convert_bboxes_coco_to_yolo(bboxes, img_width, img_height):
+    """Конвертация массива bbox (N, 4) из COCO в YOLO формат одной векторной операцией"""
+    bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+    yolo = np.empty_like(bboxes)
+    yolo[:, 0] = (bboxes[:, 0] + bboxes[:, 2] / 2) / img_width
+    yolo[:, 1] = (bboxes[:, 1] + bboxes[:, 3] / 2) / img_height
+    yolo[:, 2] = bboxes[:, 2] / img_width
+    yolo[:, 3] = bboxes[:, 3] / img_height
+    return yolo
+
+def iter_coco_section(coco_path, section):
+    """
+    Потоковое чтение одного массива COCO (images, annotations, categories)
+
+    ijson разбирает файл по одному элементу, поэтому весь JSON
+    не загружается в память целиком.
+    """
+    with open(coco_path, 'rb') as f:
+        yield from ijson.items(f, f'{section}.item', use_float=True)
+
+def create_category_mapping(categories):
     """Создание маппинга category_id -> yolo_class_id"""
     category_mapping = {}
 
-    for cat in coco_data['categories']:
+    for cat in categories:
         cat_name = cat['name']
         if cat_name in TARGET_CATEGORIES:
             category_mapping[cat['id']] = TARGET_CATEGORIES[cat_name]
@@ -47,26 +61,143 @@ def create_category_mapping(coco_data):
 
     return category_mapping
 
-def find_image_path(image_filename, images_dir):
-    """Поиск пути к изображению"""
+def build_image_index(images_dir):
+    """Однократный обход images_dir: индексы по относительному пути и по имени файла"""
+    by_relpath = {}
+    by_basename = {}
+
+    for root, dirs, files in os.walk(images_dir):
+        for filename in files:
+            full_path = os.path.join(root, filename)
+            by_relpath[os.path.relpath(full_path, images_dir)] = full_path
+            # Как и при os.walk, побеждает первое найденное совпадение
+            by_basename.setdefault(filename, full_path)
+
+    return by_relpath, by_basename
+
+def find_image_path(image_filename, image_index):
+    """Поиск пути к изображению по индексу из build_image_index"""
+    by_relpath, by_basename = image_index
+
     if '/' in image_filename or '\\' in image_filename:
-        full_path = os.path.join(images_dir, image_filename)
-        if os.path.exists(full_path):
+        full_path = by_relpath.get(os.path.normpath(image_filename))
+        if full_path is not None:
             return full_path
 
-    for root, dirs, files in os.walk(images_dir):
-        if image_filename in files:
-            return os.path.join(root, image_filename)
+    full_path = by_basename.get(image_filename)
+    if full_path is not None:
+        return full_path
 
     base_name = os.path.splitext(image_filename)[0]
     for ext in ['.jpg', '.JPG', '.jpeg', '.JPEG', '.png', '.PNG']:
-        filename = base_name + ext
-        for root, dirs, files in os.walk(images_dir):
-            if filename in files:
-                return os.path.join(root, filename)
+        full_path = by_basename.get(base_name + ext)
+        if full_path is not None:
+            return full_path
 
     return None
 
+# Маркеры SOFn (baseline, progressive, lossless, arithmetic) - в них размеры JPEG
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+def read_jpeg_size(image_path):
+    """
+    Размеры JPEG из маркера SOFn без PIL/libjpeg
+
+    Проходит по заголовкам сегментов до SOFn (содержимое пропускается seek),
+    читаются только заголовки. None, если это не JPEG или маркер не найден.
+    """
+    with open(image_path, 'rb') as f:
+        if f.read(2) != b'\xff\xd8':
+            return None
+
+        while True:
+            marker = f.read(2)
+            if len(marker) < 2 or marker[0] != 0xFF:
+                return None
+            # Байты-заполнители 0xFF перед маркером
+            while marker[1] == 0xFF:
+                marker = marker[1:] + f.read(1)
+                if len(marker) < 2:
+                    return None
+
+            segment_length = f.read(2)
+            if len(segment_length) < 2:
+                return None
+            segment_length = int.from_bytes(segment_length, 'big')
+
+            if marker[1] in JPEG_SOF_MARKERS:
+                sof = f.read(5)
+                if len(sof) < 5:
+                    return None
+                # precision (1 байт), height (2), width (2)
+                return int.from_bytes(sof[3:5], 'big'), int.from_bytes(sof[1:3], 'big')
+
+            f.seek(segment_length - 2, os.SEEK_CUR)
+
+def get_image_size(image_info, image_path):
+    """Размеры изображения: из COCO, а если их нет - только из заголовка файла"""
+    img_width = image_info.get('width')
+    img_height = image_info.get('height')
+    if img_width and img_height:
+        return img_width, img_height
+
+    # JPEG: размеры прямо из SOFn, без инициализации libjpeg
+    size = read_jpeg_size(image_path)
+    if size is not None:
+        return size
+
+    # Остальные форматы: Image.open читает только заголовок, пиксели не декодируются
+    with Image.open(image_path) as img:
+        return img.size
+
+def link_or_copy(src, dst):
+    """
+    Hardlink на исходное изображение, а если нельзя (другая ФС, нет прав,
+    лимит ссылок, dst уже существует) - fileops.fastcopy. Hardlink не копирует
+    ни байта данных; fastcopy сначала удаляет dst, поэтому существующий
+    hardlink на src не обнуляет исходное изображение.
+    """
+    try:
+        os.link(src, dst)
+    except OSError:
+        fileops.fastcopy(src, dst)
+
+def process_image(task, category_mapping, output_images_dir, output_labels_dir):
+    """
+    Копирование изображения и запись label для одного изображения
+
+    Выполняется в пуле процессов, возвращает {yolo_class: количество аннотаций}
+    """
+    image_info, image_path, annotations = task
+    image_filename = image_info['file_name']
+
+    img_width, img_height = get_image_size(image_info, image_path)
+
+    output_image_path = output_images_dir / image_filename
+    output_image_path.parent.mkdir(parents=True, exist_ok=True)
+    link_or_copy(image_path, output_image_path)
+
+    label_filename = os.path.splitext(image_filename)[0] + '.txt'
+    label_path = output_labels_dir / label_filename
+    label_path.parent.mkdir(parents=True, exist_ok=True)
+
+    yolo_classes = np.array([category_mapping[ann['category_id']] for ann in annotations])
+    bboxes_yolo = convert_bboxes_coco_to_yolo(
+        [ann['bbox'] for ann in annotations],
+        img_width,
+        img_height
+    )
+    # np.savetxt пишет построчно - собираем файл целиком и пишем один раз
+    label_path.write_text(''.join(
+        YOLO_LINE_FORMAT % (yolo_class, *bbox)
+        for yolo_class, bbox in zip(yolo_classes.tolist(), bboxes_yolo.tolist())
+    ))
+
+    return {
+        int(yolo_class): int(count)
+        for yolo_class, count in zip(*np.unique(yolo_classes, return_counts=True))
+    }
+
 def convert_coco_to_yolo_8classes(coco_path, images_dir, output_dir):
     """Конвертация COCO датасета в YOLO формат (8 классов)"""
     output_images_dir = Path(output_dir) / "images"
@@ -79,72 +210,63 @@ def convert_coco_to_yolo_8classes(coco_path, images_dir, output_dir):
         shutil.rmtree(output_labels_dir)
 
     print("Загрузка COCO аннотаций...")
-    coco_data = load_coco_annotations(coco_path)
-
-    print(f"Всего изображений: {len(coco_data['images'])}")
-    print(f"Всего аннотаций: {len(coco_data['annotations'])}")
-
-    category_mapping = create_category_mapping(coco_data)
+    category_mapping = create_category_mapping(iter_coco_section(coco_path, 'categories'))
     print(f"\nЦелевых категорий: {len(category_mapping)}")
 
-    output_images_dir.mkdir(parents=True, exist_ok=True)
-    output_labels_dir.mkdir(parents=True, exist_ok=True)
-
+    # В памяти остаются только нужные аннотации, а не весь JSON
+    total_coco_annotations = 0
     annotations_by_image = defaultdict(list)
-    for ann in coco_data['annotations']:
+    for ann in iter_coco_section(coco_path, 'annotations'):
+        total_coco_annotations += 1
         if ann['category_id'] in category_mapping:
             annotations_by_image[ann['image_id']].append(ann)
 
-    images_dict = {img['id']: img for img in coco_data['images']}
+    images_dict = {img['id']: img for img in iter_coco_section(coco_path, 'images')}
+
+    print(f"Всего изображений: {len(images_dict)}")
+    print(f"Всего аннотаций: {total_coco_annotations}")
+
+    output_images_dir.mkdir(parents=True, exist_ok=True)
+    output_labels_dir.mkdir(parents=True, exist_ok=True)
+
+    print("Индексация изображений...")
+    image_index = build_image_index(images_dir)
 
     processed_images = 0
     skipped_images = 0
     total_annotations = 0
     class_counts = defaultdict(int)
 
-    print("\nКонвертация...")
+    # Пропуски определяются здесь, в пул уходят только изображения с работой
+    tasks = []
     for image_id, image_info in images_dict.items():
-        image_filename = image_info['file_name']
-        image_path = find_image_path(image_filename, images_dir)
+        image_path = find_image_path(image_info['file_name'], image_index)
+        annotations = annotations_by_image.get(image_id, [])
 
-        if image_path is None:
+        if image_path is None or len(annotations) == 0:
             skipped_images += 1
             continue
 
-        # Получаем размеры из COCO (если нет - используем дефолтные)
-        img_width = image_info.get('width', 1920)
-        img_height = image_info.get('height', 1080)
+        tasks.append((image_info, image_path, annotations))
 
-        annotations = annotations_by_image.get(image_id, [])
+    worker = partial(
+        process_image,
+        category_mapping=category_mapping,
+        output_images_dir=output_images_dir,
+        output_labels_dir=output_labels_dir
+    )
 
-        if len(annotations) == 0:
-            skipped_images += 1
-            continue
+    print(f"\nКонвертация ({os.cpu_count()} процессов)...")
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+        for image_class_counts in executor.map(worker, tasks, chunksize=64):
+            for yolo_class, count in image_class_counts.items():
+                class_counts[yolo_class] += count
+                total_annotations += count
+
+            processed_images += 1
 
-        output_image_path = output_images_dir / image_filename
-        output_image_path.parent.mkdir(parents=True, exist_ok=True)
-        shutil.copy2(image_path, output_image_path)
-
-        label_filename = os.path.splitext(image_filename)[0] + '.txt'
-        label_path = output_labels_dir / label_filename
-        label_path.parent.mkdir(parents=True, exist_ok=True)
-
-        with open(label_path, 'w') as f:
-            for ann in annotations:
-                yolo_class = category_mapping[ann['category_id']]
-                bbox_yolo = convert_bbox_coco_to_yolo(
-                    ann['bbox'],
-                    img_width,
-                    img_height
-                )
-                f.write(f"{yolo_class} {bbox_yolo[0]:.6f} {bbox_yolo[1]:.6f} {bbox_yolo[2]:.6f} {bbox_yolo[3]:.6f}\n")
-                class_counts[yolo_class] += 1
-
-        processed_images += 1
-        total_annotations += len(annotations)
-
-        if processed_images % 100 == 0:
-            print(f"Обработано изображений: {processed_images}")
+            if processed_images % 100 == 0:
+                print(f"Обработано изображений: {processed_images}")
 
     print(f"\n✅ Конвертация завершена!")
     print(f"   Обработано изображений: {processed_images}")
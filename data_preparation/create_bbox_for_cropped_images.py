@@ -6,11 +6,18 @@
 мы создаём bbox на весь размер изображения с небольшим отступом.
 """
 
+import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from PIL import Image
-import shutil
 from typing import Dict, Tuple
 
+import fileops
+
+# Префиксы имён выходных файлов: {dataset_name}_{asset}_{class_name}_{stem}
+DEFECT_SUPERVISED_NAME = 'defect_supervised'
+UNSUPERVISED_NAME = 'unsupervised'
+FAULT_DATASET_NAMES = (DEFECT_SUPERVISED_NAME, UNSUPERVISED_NAME)
+
 # Маппинг InsPLAD fault классов → ваши классы
 FAULT_CLASS_MAPPING = {
     # Из defect_supervised и unsupervised_anomaly_detection
@@ -41,47 +48,73 @@ FAULT_CLASS_MAPPING = {
 
 
 def create_full_image_bbox(
-    image_path: Path,
     class_id: int,
     padding: float = 0.025
 ) -> str:
     """
     Создаёт YOLO bbox на весь размер изображения
     
+    Bbox задаётся в нормализованных координатах и не зависит от размеров
+    изображения, поэтому строка считается один раз на класс, а не на файл.
+    
     Args:
-        image_path: Путь к изображению
         class_id: ID класса (0-7)
         padding: Отступ от краёв (0.025 = 2.5% с каждой стороны)
     
     Returns:
         YOLO format string: "class_id x_center y_center width height"
     """
+    # Создаём bbox с отступами
+    # Центр всегда (0.5, 0.5) так как объект в центре
+    x_center = 0.5
+    y_center = 0.5
+    
+    # Размер bbox = почти всё изображение (с отступом)
+    bbox_width = 1.0 - (2 * padding)
+    bbox_height = 1.0 - (2 * padding)
+    
+    # Убедимся что в диапазоне [0, 1]
+    x_center = max(0.0, min(1.0, x_center))
+    y_center = max(0.0, min(1.0, y_center))
+    bbox_width = max(0.0, min(1.0, bbox_width))
+    bbox_height = max(0.0, min(1.0, bbox_height))
+    
+    return f"{class_id} {x_center:.6f} {y_center:.6f} {bbox_width:.6f} {bbox_height:.6f}\n"
+
+
+def write_label(label_path: Path, data: bytes):
+    """
+    Записывает label напрямую через os.open/os.write
+    
+    Label - это одна строка (< 100 байт), поэтому TextIOWrapper/BufferedWriter
+    только добавляют работы: здесь open + write + close и ничего больше.
+    """
+    fd = os.open(label_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
     try:
-        # Открываем изображение чтобы получить размеры
-        img = Image.open(image_path)
-        width, height = img.size
-        img.close()
-        
-        # Создаём bbox с отступами
-        # Центр всегда (0.5, 0.5) так как объект в центре
-        x_center = 0.5
-        y_center = 0.5
-        
-        # Размер bbox = почти всё изображение (с отступом)
-        bbox_width = 1.0 - (2 * padding)
-        bbox_height = 1.0 - (2 * padding)
-        
-        # Убедимся что в диапазоне [0, 1]
-        x_center = max(0.0, min(1.0, x_center))
-        y_center = max(0.0, min(1.0, y_center))
-        bbox_width = max(0.0, min(1.0, bbox_width))
-        bbox_height = max(0.0, min(1.0, bbox_height))
-        
-        return f"{class_id} {x_center:.6f} {y_center:.6f} {bbox_width:.6f} {bbox_height:.6f}\n"
+        os.write(fd, data)
+    finally:
+        os.close(fd)
+
+
+def copy_image_with_label(task: Tuple[os.DirEntry, Path, Path, bytes]) -> bool:
+    """
+    Копирует изображение и сохраняет его label (выполняется в пуле потоков)
+    
+    Args:
+        task: (исходное изображение, путь для изображения, путь для label, bbox в bytes)
+    
+    Returns:
+        True при успехе, False при ошибке
+    """
+    img_path, output_img_path, output_label_path, bbox_line = task
+    try:
+        fileops.fastcopy(img_path, output_img_path)
+        write_label(output_label_path, bbox_line)
+        return True
     
     except Exception as e:
-        print(f"❌ Ошибка создания bbox для {image_path}: {e}")
-        return None
+        print(f"         ❌ Ошибка {img_path.name}: {e}")
+        return False
 
 
 def process_fault_dataset(
@@ -110,6 +143,15 @@ def process_fault_dataset(
     print(f"\n📂 Обработка {dataset_name}: {fault_dataset_dir.name}")
     print("-" * 60)
     
+    # (исходное изображение, путь изображения, путь label, bbox в bytes) и класс каждой задачи
+    tasks = []
+    task_class_ids = []
+    
+    # Создаём выходные папки один раз, а не на каждый класс
+    for split in ['train', 'test', 'val']:
+        (output_dir / 'images' / split).mkdir(parents=True, exist_ok=True)
+        (output_dir / 'labels' / split).mkdir(parents=True, exist_ok=True)
+    
     # Проходим по всем asset папкам
     for asset_dir in fault_dataset_dir.iterdir():
         if not asset_dir.is_dir():
@@ -137,48 +179,43 @@ def process_fault_dataset(
                 
                 your_class_id, your_class_name = FAULT_CLASS_MAPPING[class_name]
                 
-                # Находим все изображения
-                images = list(class_dir.glob('*.jpg')) + list(class_dir.glob('*.JPG'))
+                # Находим все изображения (os.scandir: тип файла из dirent, без stat на файл)
+                with os.scandir(class_dir) as it:
+                    images = [
+                        entry for entry in it
+                        if entry.name.endswith(('.jpg', '.JPG')) and entry.is_file(follow_symlinks=False)
+                    ]
                 
                 if not images:
                     continue
                 
                 print(f"      ✓ {class_name} → класс {your_class_id} ({your_class_name}): {len(images)} images")
                 
-                # Создаём выходные папки
                 output_images_dir = output_dir / 'images' / split
                 output_labels_dir = output_dir / 'labels' / split
-                output_images_dir.mkdir(parents=True, exist_ok=True)
-                output_labels_dir.mkdir(parents=True, exist_ok=True)
                 
-                # Обрабатываем каждое изображение
-                for img_path in images:
-                    try:
-                        # Создаём bbox
-                        bbox_line = create_full_image_bbox(img_path, your_class_id)
-                        
-                        if bbox_line is None:
-                            stats['skipped'] += 1
-                            continue
-                        
-                        # Уникальное имя файла
-                        unique_name = f"{dataset_name}_{asset_dir.name}_{class_name}_{img_path.stem}{img_path.suffix}"
-                        
-                        # Копируем изображение
-                        output_img_path = output_images_dir / unique_name
-                        shutil.copy2(img_path, output_img_path)
-                        
-                        # Сохраняем label
-                        output_label_path = output_labels_dir / f"{Path(unique_name).stem}.txt"
-                        with open(output_label_path, 'w') as f:
-                            f.write(bbox_line)
-                        
-                        stats['processed'] += 1
-                        stats['by_class'][your_class_id] = stats['by_class'].get(your_class_id, 0) + 1
+                # Bbox одинаковый для всех изображений класса
+                bbox_line = create_full_image_bbox(your_class_id).encode()
+                
+                # Собираем задачи для каждого изображения
+                for entry in images:
+                    # Уникальное имя файла
+                    stem, suffix = os.path.splitext(entry.name)
+                    unique_stem = f"{dataset_name}_{asset_dir.name}_{class_name}_{stem}"
                     
-                    except Exception as e:
-                        print(f"         ❌ Ошибка {img_path.name}: {e}")
-                        stats['skipped'] += 1
+                    output_img_path = output_images_dir / f"{unique_stem}{suffix}"
+                    output_label_path = output_labels_dir / f"{unique_stem}.txt"
+                    tasks.append((entry, output_img_path, output_label_path, bbox_line))
+                    task_class_ids.append(your_class_id)
+    
+    # Копирование - чистый I/O, поэтому пул потоков
+    with ThreadPoolExecutor(max_workers=fileops.IO_WORKERS) as executor:
+        for your_class_id, ok in zip(task_class_ids, executor.map(copy_image_with_label, tasks)):
+            if ok:
+                stats['processed'] += 1
+                stats['by_class'][your_class_id] = stats['by_class'].get(your_class_id, 0) + 1
+            else:
+                stats['skipped'] += 1
     
     return stats
 
@@ -217,7 +254,7 @@ def main():
         stats1 = process_fault_dataset(
             defect_supervised_dir,
             output_dir,
-            'defect_supervised'
+            DEFECT_SUPERVISED_NAME
         )
         total_stats['processed'] += stats1['processed']
         total_stats['skipped'] += stats1['skipped']
@@ -229,7 +266,7 @@ def main():
         stats2 = process_fault_dataset(
             unsupervised_dir,
             output_dir,
-            'unsupervised'
+            UNSUPERVISED_NAME
         )
         total_stats['processed'] += stats2['processed']
         total_stats['skipped'] += stats2['skipped']
@@ -0,0 +1,102 @@
+"""
+Общие функции копирования файлов для скриптов подготовки датасета
+
+Все копирования изображений в data_preparation идут через fastcopy:
+convert_coco_to_yolo_8classes, prepare_8class_dataset_simple (link_or_copy),
+merge_all_insplad_datasets, merge_external_dataset и
+create_bbox_for_cropped_images. Своих циклов копирования в скриптах нет:
+только fastcopy удаляет dst перед записью, и hardlink/symlink на исходное
+изображение не затирается.
+
+Скрипты запускаются напрямую (python data_preparation/<script>.py), поэтому
+модуль импортируется как `import fileops`.
+"""
+
+import errno
+import os
+
+# Потоков для копирования (задача I/O-bound, GIL не мешает)
+IO_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+
+# errno, при которых copy_file_range/sendfile не работают для пары файлов/ФС
+KERNEL_COPY_UNSUPPORTED = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ETXTBSY}
+
+# Буфер для копирования, если копирование в ядре недоступно
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+def fastcopy(src, dst):
+    """
+    Копирует только содержимое файла, без метаданных (в отличие от shutil.copy2)
+
+    Сначала os.copy_file_range (копирование внутри ядра, reflink на CoW ФС),
+    затем os.sendfile, и только потом _copy_readinto с буфером 1 MB.
+    """
+    # dst может быть hardlink/symlink на исходное изображение (прошлый запуск
+    # с линками): запись в него затёрла бы оригинал, поэтому dst удаляется
+    try:
+        os.unlink(dst)
+    except FileNotFoundError:
+        pass
+
+    with open(src, 'rb', buffering=0) as fsrc, open(dst, 'wb') as fdst:
+        src_fd = fsrc.fileno()
+        dst_fd = fdst.fileno()
+        size = os.fstat(src_fd).st_size
+
+        for kernel_copy in (_copy_file_range, _sendfile):
+            try:
+                if kernel_copy(src_fd, dst_fd, size):
+                    return
+            except OSError as e:
+                if e.errno not in KERNEL_COPY_UNSUPPORTED:
+                    raise
+            # Частично скопированное не считается: начинаем заново
+            os.lseek(src_fd, 0, os.SEEK_SET)
+            os.ftruncate(dst_fd, 0)
+            os.lseek(dst_fd, 0, os.SEEK_SET)
+
+        _copy_readinto(fsrc, fdst)
+
+
+def _copy_file_range(src_fd, dst_fd, size):
+    """os.copy_file_range (Linux >= 4.5, Python >= 3.8); False, если вызова нет"""
+    if not hasattr(os, 'copy_file_range'):
+        return False
+    remaining = size
+    while remaining > 0:
+        copied = os.copy_file_range(src_fd, dst_fd, remaining)
+        if copied == 0:
+            break
+        remaining -= copied
+    return True
+
+
+def _sendfile(src_fd, dst_fd, size):
+    """os.sendfile в обычный файл (Linux >= 2.6.33); False, если вызова нет"""
+    if not hasattr(os, 'sendfile'):
+        return False
+    offset = 0
+    while offset < size:
+        sent = os.sendfile(dst_fd, src_fd, offset, size - offset)
+        if sent == 0:
+            break
+        offset += sent
+    return True
+
+
+def _copy_readinto(fsrc, fdst):
+    """
+    Копирование через один буфер 1 MB (readinto без новых bytes на каждый блок)
+
+    posix_fadvise(SEQUENTIAL) просит ядро читать источник вперёд агрессивнее.
+    """
+    buf = bytearray(COPY_BUFFER_SIZE)
+    view = memoryview(buf)
+    if hasattr(os, 'posix_fadvise'):
+        os.posix_fadvise(fsrc.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+    while True:
+        n = fsrc.readinto(view)
+        if not n:
+            break
+        fdst.write(view[:n])
@@ -4,17 +4,65 @@
 Обрезает координаты до диапазона [0.0, 1.0]
 """
 
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+import re
+
+import numpy as np
+
+# Координата, которая заведомо уже в [0, 1]: 0, 0.xxx, .xxx, 1, 1.000
+_VALID_COORD = rb'(?:0(?:\.\d*)?|1(?:\.0*)?|\.\d+)'
+_VALID_LINE = rb'[ \t]*\d+(?:[ \t]+' + _VALID_COORD + rb'){4}[ \t]*'
+
+# Файл целиком из корректных строк (пустые строки допускаются)
+VALID_LABEL_RE = re.compile(rb'(?:(?:' + _VALID_LINE + rb')?\r?\n)*(?:' + _VALID_LINE + rb')?')
 
 def fix_bbox_coordinates(label_path: Path) -> bool:
     """Исправляет координаты в YOLO label файле"""
     try:
-        with open(label_path, 'r') as f:
-            lines = f.readlines()
+        with open(label_path, 'rb') as f:
+            data = f.read()
+        
+        # Большинство файлов уже корректны: одна проверка regex без разбора чисел
+        if VALID_LABEL_RE.fullmatch(data):
+            return False
+        
+        lines = data.decode().splitlines(keepends=True)
+        
+        if not any(line.strip() for line in lines):
+            return False
         
-        if not lines:
+        # Быстрый путь: весь файл разбирается и обрезается одной операцией NumPy
+        try:
+            boxes = np.loadtxt(lines, ndmin=2)
+        except ValueError:
+            # Неполные или нечисловые строки - построчная обработка
+            return fix_bbox_lines(label_path, lines)
+        
+        if boxes.size == 0:
+            return False
+        
+        if boxes.shape[1] < 5:
+            return fix_bbox_lines(label_path, lines)
+        
+        coords = boxes[:, 1:5]
+        fixed_coords = np.clip(coords, 0.0, 1.0)
+        
+        if np.array_equal(coords, fixed_coords):
             return False
         
+        # Сохраняем исправленный файл
+        np.savetxt(label_path, np.column_stack([boxes[:, 0], fixed_coords]), fmt=['%d'] + ['%.6f'] * 4)
+        return True
+    
+    except Exception as e:
+        print(f"❌ Ошибка {label_path}: {e}")
+        return False
+
+
+def fix_bbox_lines(label_path: Path, lines: list) -> bool:
+    """Построчное исправление координат (для файлов с некорректными строками)"""
+    try:
         fixed_lines = []
         was_fixed = False
         
@@ -71,27 +119,31 @@ def main():
     total_fixed = 0
     total_labels = 0
     
-    for split in ['train', 'val', 'test']:
-        labels_dir = dataset_path / 'labels' / split
-        if not labels_dir.exists():
-            print(f"⚠️ Не найден: {labels_dir}")
-            continue
-        
-        print(f"\n📂 Обработка {split}...")
-        
-        split_fixed = 0
-        split_total = 0
-        
-        for label_file in labels_dir.glob('*.txt'):
-            split_total += 1
-            if fix_bbox_coordinates(label_file):
-                split_fixed += 1
-        
-        total_labels += split_total
-        total_fixed += split_fixed
-        
-        print(f"   Всего labels: {split_total}")
-        print(f"   Исправлено: {split_fixed} ({100*split_fixed/split_total if split_total > 0 else 0:.1f}%)")
+    # Разбор строк - CPU-bound, поэтому процессы, а не потоки
+    with ProcessPoolExecutor() as executor:
+        for split in ['train', 'val', 'test']:
+            labels_dir = dataset_path / 'labels' / split
+            if not labels_dir.exists():
+                print(f"⚠️ Не найден: {labels_dir}")
+                continue
+            
+            print(f"\n📂 Обработка {split}...")
+            
+            split_fixed = 0
+            split_total = 0
+            
+            # Файлы мелкие: chunksize, чтобы IPC не съедал выигрыш от процессов
+            label_files = list(labels_dir.glob('*.txt'))
+            for was_fixed in executor.map(fix_bbox_coordinates, label_files, chunksize=256):
+                split_total += 1
+                if was_fixed:
+                    split_fixed += 1
+            
+            total_labels += split_total
+            total_fixed += split_fixed
+            
+            print(f"   Всего labels: {split_total}")
+            print(f"   Исправлено: {split_fixed} ({100*split_fixed/split_total if split_total > 0 else 0:.1f}%)")
     
     print("\n" + "="*60)
     print(f"✅ ГОТОВО!")
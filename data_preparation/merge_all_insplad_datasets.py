@@ -11,11 +11,26 @@
 """
 
 from pathlib import Path
-import json
+import argparse
+import io
+import os
 import shutil
-from collections import defaultdict
+import tarfile
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 import random
 
+import ijson
+import numpy as np
+from tqdm import tqdm
+
+import fileops
+from create_bbox_for_cropped_images import FAULT_CLASS_MAPPING, FAULT_DATASET_NAMES
+
+YOLO_LINE_FORMAT = '%d %.6f %.6f %.6f %.6f'
+
 # Маппинг InsPLAD-det классов → ваши классы
 INSPLAD_DET_MAPPING = {
     # Vibration dampers
@@ -30,44 +45,132 @@ INSPLAD_DET_MAPPING = {
     7: (5, 'polymer_insulators'),   # polymer insulator
 }
 
+# Класс fault изображения по имени папки-класса, которое create_bbox_for_cropped_images
+# вшивает в имя файла: {dataset}_{asset}_{class_name}_{stem}
+FAULT_CLASS_IDS = {name: cid for name, (cid, _) in FAULT_CLASS_MAPPING.items()}
+
+# Длинные имена классов проверяются первыми, чтобы префикс не перехватил класс
+FAULT_CLASS_NAMES_LONGEST_FIRST = sorted(FAULT_CLASS_IDS, key=len, reverse=True)
+
+
+def write_label(label_path, data):
+    """Записывает label (bytes) через os.open/os.write, без буферизованного текстового файла"""
+    fd = os.open(label_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        os.write(fd, data)
+    finally:
+        os.close(fd)
+
+
+def store_file(src, dst, tar=None):
+    """Копирует файл в dst или, если передан tar, добавляет его в архив под этим путём"""
+    if tar is None:
+        fileops.fastcopy(src, dst)
+    else:
+        tar.add(os.fspath(src), arcname=os.fspath(dst).replace(os.sep, '/'), recursive=False)
+
+
+def store_bytes(data, dst, tar=None):
+    """Записывает label (bytes) в dst или, если передан tar, добавляет его в архив"""
+    if tar is None:
+        write_label(dst, data)
+        return
+
+    tarinfo = tarfile.TarInfo(os.fspath(dst).replace(os.sep, '/'))
+    tarinfo.size = len(data)
+    tarinfo.mode = 0o644
+    tarinfo.mtime = int(time.time())
+    tar.addfile(tarinfo, io.BytesIO(data))
+
+
+def iter_files(directory, suffix):
+    """
+    Файлы directory с расширением suffix (os.DirEntry)
+
+    os.scandir берёт тип файла из dirent, поэтому, в отличие от Path.glob,
+    не делает stat на каждый файл и не создаёт Path на каждую запись.
+    """
+    with os.scandir(directory) as it:
+        for entry in it:
+            if entry.name.endswith(suffix) and entry.is_file(follow_symlinks=False):
+                yield entry
+
+
+def iter_coco_section(coco_file, section):
+    """Потоковый разбор массива COCO JSON (images / annotations) через ijson"""
+    with open(coco_file, 'rb') as f:
+        yield from ijson.items(f, f'{section}.item', use_float=True)
+
+
+def file_names(directory, suffix=''):
+    """
+    Имена файлов directory с расширением suffix (пустое множество, если папки нет)
+
+    Один scandir вместо exists() (stat) на каждый проверяемый файл.
+    """
+    if not os.path.isdir(directory):
+        return set()
+    return {entry.name for entry in iter_files(directory, suffix)}
+
+
+def existing_image_names(images_dir):
+    """Имена изображений, уже лежащих в split итогового датасета"""
+    return file_names(images_dir, '.jpg')
+
 
-def convert_coco_to_yolo(annotation, image_info, category_mapping):
-    """Конвертирует COCO bbox в YOLO format"""
-    category_id = annotation['category_id']
+def free_name(name, existing_names):
+    """Имя без конфликта с existing_names: если занято - с префиксом new_"""
+    if name in existing_names:
+        name = f"new_{name}"
+    existing_names.add(name)
+    return name
 
-    if category_id not in category_mapping:
-        return None
 
-    your_class_id, your_class_name = category_mapping[category_id]
+def convert_coco_to_yolo(annotations, image_info, category_mapping):
+    """
+    Конвертирует COCO bbox всех annotations изображения в YOLO format
+
+    Все bbox пересчитываются одной векторной операцией NumPy, а label
+    форматируется одним np.savetxt вместо f-строки на каждый bbox.
+
+    Returns:
+        (список class_id, содержимое label в bytes)
+    """
+    annotations = [ann for ann in annotations if ann['category_id'] in category_mapping]
+    class_ids = [category_mapping[ann['category_id']][0] for ann in annotations]
+
+    if not class_ids:
+        return [], b''
 
     # COCO: [x, y, width, height] (top-left corner)
-    x, y, w, h = annotation['bbox']
+    bboxes = np.array([ann['bbox'] for ann in annotations], dtype=np.float64).reshape(-1, 4)
     img_w = image_info['width']
     img_h = image_info['height']
 
-    # YOLO: [x_center, y_center, width, height] (normalized)
-    x_center = (x + w / 2) / img_w
-    y_center = (y + h / 2) / img_h
-    norm_w = w / img_w
-    norm_h = h / img_h
+    # YOLO: [class_id, x_center, y_center, width, height] (normalized)
+    yolo = np.empty((len(class_ids), 5), dtype=np.float64)
+    yolo[:, 0] = class_ids
+    yolo[:, 1] = (bboxes[:, 0] + bboxes[:, 2] / 2) / img_w
+    yolo[:, 2] = (bboxes[:, 1] + bboxes[:, 3] / 2) / img_h
+    yolo[:, 3] = bboxes[:, 2] / img_w
+    yolo[:, 4] = bboxes[:, 3] / img_h
 
     # Clamp to [0, 1]
-    x_center = max(0.0, min(1.0, x_center))
-    y_center = max(0.0, min(1.0, y_center))
-    norm_w = max(0.0, min(1.0, norm_w))
-    norm_h = max(0.0, min(1.0, norm_h))
+    np.clip(yolo[:, 1:], 0.0, 1.0, out=yolo[:, 1:])
 
-    return f"{your_class_id} {x_center:.6f} {y_center:.6f} {norm_w:.6f} {norm_h:.6f}"
+    buf = io.BytesIO()
+    np.savetxt(buf, yolo, fmt=YOLO_LINE_FORMAT)
+    return class_ids, buf.getvalue()
 
 
-def process_insplad_det(insplad_dir, output_dir):
-    """Обрабатывает InsPLAD-det (COCO → YOLO)"""
+def process_insplad_det(insplad_dir, output_dir, tar=None):
+    """Обрабатывает InsPLAD-det (COCO → YOLO) сразу в итоговый датасет (или в tar архив)"""
 
     print("\n" + "="*60)
     print("📦 ОБРАБОТКА InsPLAD-det")
     print("="*60)
 
-    stats = {'processed': 0, 'skipped': 0, 'by_class': defaultdict(int)}
+    stats = {'processed': 0, 'skipped': 0, 'by_class': Counter()}
 
     # Обрабатываем train и val
     for split in ['train', 'val']:
@@ -80,58 +183,68 @@ def process_insplad_det(insplad_dir, output_dir):
 
         print(f"\n📂 Обработка {split}...")
 
-        # Читаем COCO annotations
-        with open(coco_file, 'r') as f:
-            coco_data = json.load(f)
+        # Выходные папки split создаём один раз, а не на каждое изображение
+        output_img_dir = output_dir / 'images' / split
+        output_label_dir = output_dir / 'labels' / split
+        if tar is None:
+            output_img_dir.mkdir(parents=True, exist_ok=True)
+            output_label_dir.mkdir(parents=True, exist_ok=True)
+
+        # Файлы уже в датасете: при совпадении имени добавляется prefix new_
+        existing_names = existing_image_names(output_img_dir)
+
+        # Изображения split одним scandir: exists() только для путей с подпапками
+        image_names = file_names(images_dir)
+
+        # Пути внутри цикла собираются из строк, без Path на каждое изображение
+        images_dir = os.fspath(images_dir)
+        output_img_dir = os.fspath(output_img_dir)
+        output_label_dir = os.fspath(output_label_dir)
+
+        # Читаем COCO annotations потоково: весь JSON в память не загружается
 
         # Создаём маппинг image_id → image_info
-        images_map = {img['id']: img for img in coco_data['images']}
+        images_map = {img['id']: img for img in iter_coco_section(coco_file, 'images')}
 
-        # Группируем annotations по image_id
+        # Группируем annotations по image_id (только нужные классы)
         annotations_by_image = defaultdict(list)
-        for ann in coco_data['annotations']:
-            annotations_by_image[ann['image_id']].append(ann)
+        for ann in iter_coco_section(coco_file, 'annotations'):
+            if ann['category_id'] in INSPLAD_DET_MAPPING:
+                annotations_by_image[ann['image_id']].append(ann)
 
-        # Обрабатываем каждое изображение
-        for image_id, image_info in images_map.items():
+        # Обрабатываем каждое изображение (прогресс выводится не чаще раза в mininterval)
+        progress = tqdm(images_map.items(), total=len(images_map), desc=split, mininterval=0.5)
+        for image_id, image_info in progress:
             image_filename = image_info['file_name']
-            image_path = images_dir / image_filename
+            image_path = os.path.join(images_dir, image_filename)
 
-            if not image_path.exists():
+            if image_filename not in image_names and not os.path.exists(image_path):
                 stats['skipped'] += 1
                 continue
 
             # Конвертируем все annotations для этого изображения
-            yolo_lines = []
-            for ann in annotations_by_image.get(image_id, []):
-                yolo_line = convert_coco_to_yolo(ann, image_info, INSPLAD_DET_MAPPING)
-                if yolo_line:
-                    yolo_lines.append(yolo_line)
-                    class_id = int(yolo_line.split()[0])
-                    stats['by_class'][class_id] += 1
+            class_ids, label_data = convert_coco_to_yolo(
+                annotations_by_image.get(image_id, []),
+                image_info,
+                INSPLAD_DET_MAPPING
+            )
+            stats['by_class'].update(class_ids)
 
             # Пропускаем изображения без релевантных объектов
-            if not yolo_lines:
+            if not class_ids:
                 stats['skipped'] += 1
                 continue
 
             # Копируем изображение
-            output_img_dir = output_dir / 'images' / split
-            output_img_dir.mkdir(parents=True, exist_ok=True)
-
-            unique_name = f"insplad_det_{split}_{image_filename}"
-            output_img_path = output_img_dir / unique_name
-            shutil.copy2(image_path, output_img_path)
+            unique_name = free_name(f"insplad_det_{split}_{image_filename}", existing_names)
+            output_img_path = os.path.join(output_img_dir, unique_name)
+            store_file(image_path, output_img_path, tar)
 
             # Сохраняем label
-            output_label_dir = output_dir / 'labels' / split
-            output_label_dir.mkdir(parents=True, exist_ok=True)
+            label_filename = os.path.splitext(unique_name)[0] + '.txt'
+            output_label_path = os.path.join(output_label_dir, label_filename)
 
-            label_filename = Path(unique_name).stem + '.txt'
-            output_label_path = output_label_dir / label_filename
-
-            with open(output_label_path, 'w') as f:
-                f.write('\n'.join(yolo_lines) + '\n')
+            store_bytes(label_data, output_label_path, tar)
 
             stats['processed'] += 1
 
@@ -140,14 +253,58 @@ def process_insplad_det(insplad_dir, output_dir):
     return stats
 
 
-def merge_fault_dataset(fault_dir, output_dir):
-    """Копирует insplad_fault_with_bbox в output"""
+def fault_class_from_name(stem):
+    """
+    class_id fault изображения по имени файла или None, если класс не распознан
+
+    Имя разбирается по позициям {dataset}_{asset}_{class_name}_{stem}: известный
+    префикс датасета отрезается, asset (имена папок InsPLAD через дефис, без '_')
+    - до первого '_', и класс должен стоять сразу после него. Токены классов
+    внутри asset или исходного stem на результат не влияют; если имя не
+    разбирается, возвращается None и класс читается из label.
+    """
+    for dataset_name in FAULT_DATASET_NAMES:
+        prefix = f"{dataset_name}_"
+        if not stem.startswith(prefix):
+            continue
+        _, sep, rest = stem[len(prefix):].partition('_')
+        if not sep:
+            continue
+        for class_name in FAULT_CLASS_NAMES_LONGEST_FIRST:
+            if rest.startswith(f"{class_name}_"):
+                return FAULT_CLASS_IDS[class_name]
+    return None
+
+
+def copy_fault_image(task, tar=None):
+    """
+    Копирует изображение fault датасета вместе с label (в пуле потоков или в tar)
+
+    Возвращает список class_id. Класс берётся из имени файла,
+    label перечитывается только если имя не распознано.
+    """
+    img_path, stem, label_path, output_img_path, output_label_path = task
+
+    store_file(img_path, output_img_path, tar)
+    store_file(label_path, output_label_path, tar)
+
+    # В fault датасете один bbox на изображение с классом из имени папки
+    class_id = fault_class_from_name(stem)
+    if class_id is not None:
+        return [class_id]
+
+    with open(label_path, 'r') as f:
+        return [int(line.split()[0]) for line in f]
+
+
+def merge_fault_dataset(fault_dir, output_dir, tar=None):
+    """Копирует insplad_fault_with_bbox сразу в итоговый датасет (или в tar архив)"""
 
     print("\n" + "="*60)
     print("📦 ОБЪЕДИНЕНИЕ insplad_fault_with_bbox")
     print("="*60)
 
-    stats = {'processed': 0, 'skipped': 0, 'by_class': defaultdict(int)}
+    stats = {'processed': 0, 'skipped': 0, 'by_class': Counter()}
 
     if not fault_dir.exists():
         print("⚠️ insplad_fault_with_bbox не найден, пропускаем")
@@ -163,87 +320,52 @@ def merge_fault_dataset(fault_dir, output_dir):
 
         print(f"\n📂 Копирование {split}...")
 
-        # Находим все изображения
-        for img_path in images_dir.glob('*.jpg'):
-            label_path = labels_dir / f"{img_path.stem}.txt"
-
-            if not label_path.exists():
-                stats['skipped'] += 1
-                continue
-
-            # Копируем изображение
-            output_img_dir = output_dir / 'images' / split
+        output_img_dir = output_dir / 'images' / split
+        output_label_dir = output_dir / 'labels' / split
+        if tar is None:
             output_img_dir.mkdir(parents=True, exist_ok=True)
-            shutil.copy2(img_path, output_img_dir / img_path.name)
-
-            # Копируем label
-            output_label_dir = output_dir / 'labels' / split
             output_label_dir.mkdir(parents=True, exist_ok=True)
-            shutil.copy2(label_path, output_label_dir / label_path.name)
-
-            # Статистика
-            with open(label_path, 'r') as f:
-                for line in f:
-                    class_id = int(line.split()[0])
-                    stats['by_class'][class_id] += 1
-
-            stats['processed'] += 1
 
-        print(f"   ✓ Скопировано: {stats['processed']} images")
+        # Файлы уже в датасете: при совпадении имени добавляется prefix new_
+        existing_names = existing_image_names(output_img_dir)
 
-    return stats
-
-
-def merge_with_existing_dataset(source_dir, target_dir):
-    """Объединяет новые данные с существующим dataset_8classes"""
-
-    print("\n" + "="*60)
-    print("📦 ОБЪЕДИНЕНИЕ С dataset_8classes")
-    print("="*60)
-
-    if not target_dir.exists():
-        print(f"⚠️ {target_dir} не существует, создаём новый")
-        target_dir.mkdir(parents=True)
-
-    stats = {'copied': 0}
-
-    # Копируем все новые данные
-    for split in ['train', 'val', 'test']:
-        source_img_dir = source_dir / 'images' / split
-        source_label_dir = source_dir / 'labels' / split
-
-        if not source_img_dir.exists():
-            continue
+        # Все label split одним scandir вместо exists() на каждое изображение
+        label_names = file_names(labels_dir, '.txt')
 
-        target_img_dir = target_dir / 'images' / split
-        target_label_dir = target_dir / 'labels' / split
-
-        target_img_dir.mkdir(parents=True, exist_ok=True)
-        target_label_dir.mkdir(parents=True, exist_ok=True)
-
-        print(f"\n📂 Объединение {split}...")
-
-        # Копируем изображения
-        for img_path in source_img_dir.glob('*.jpg'):
-            target_img_path = target_img_dir / img_path.name
-
-            # Если файл уже существует, добавляем prefix
-            if target_img_path.exists():
-                target_img_path = target_img_dir / f"new_{img_path.name}"
-
-            shutil.copy2(img_path, target_img_path)
-            stats['copied'] += 1
-
-        # Копируем labels
-        for label_path in source_label_dir.glob('*.txt'):
-            target_label_path = target_label_dir / label_path.name
-
-            if target_label_path.exists():
-                target_label_path = target_label_dir / f"new_{label_path.name}"
+        # Находим все изображения (пути задач - строки, без Path на каждый файл)
+        labels_dir = os.fspath(labels_dir)
+        output_img_dir = os.fspath(output_img_dir)
+        output_label_dir = os.fspath(output_label_dir)
+        tasks = []
+        for entry in iter_files(images_dir, '.jpg'):
+            stem = entry.name[:-len('.jpg')]
+            if f"{stem}.txt" not in label_names:
+                stats['skipped'] += 1
+                continue
 
-            shutil.copy2(label_path, target_label_path)
+            output_name = free_name(entry.name, existing_names)
+            tasks.append((
+                entry,
+                stem,
+                os.path.join(labels_dir, f"{stem}.txt"),
+                os.path.join(output_img_dir, output_name),
+                os.path.join(output_label_dir, f"{output_name[:-len('.jpg')]}.txt")
+            ))
+
+        # Копирование - чистый I/O, поэтому пул потоков (tar поток пишется одним потоком)
+        workers = fileops.IO_WORKERS if tar is None else 1
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            progress = tqdm(
+                executor.map(partial(copy_fault_image, tar=tar), tasks),
+                total=len(tasks), desc=split, mininterval=0.5
+            )
+            for class_ids in progress:
+                # Статистика
+                stats['by_class'].update(class_ids)
+
+                stats['processed'] += 1
 
-        print(f"   ✓ Добавлено: {stats['copied']} images")
+        print(f"   ✓ Скопировано: {stats['processed']} images")
 
     return stats
 
@@ -251,6 +373,12 @@ def merge_with_existing_dataset(source_dir, target_dir):
 def main():
     """Главная функция"""
 
+    parser = argparse.ArgumentParser(description='Объединение всех InsPLAD датасетов с dataset_8classes')
+    parser.add_argument('--archive', type=str, nargs='?', const='dataset_8classes_final.tar.gz',
+                       help='Писать результат сразу в tar.gz (по умолчанию dataset_8classes_final.tar.gz), '
+                            'dataset_8classes на диске не изменяется')
+    args = parser.parse_args()
+
     print("🔄 ФИНАЛЬНОЕ ОБЪЕДИНЕНИЕ ВСЕХ ДАТАСЕТОВ")
     print("="*60)
 
@@ -258,42 +386,47 @@ def main():
     base_dir = Path('.')
     insplad_det_dir = base_dir / 'InsPLAD-det'
     fault_dir = base_dir / 'insplad_fault_with_bbox'
-    temp_dir = base_dir / 'temp_insplad_merged'
     final_dir = base_dir / 'dataset_8classes'
 
-    # Создаём временную папку для объединения InsPLAD данных
-    temp_dir.mkdir(exist_ok=True)
-
-    # 1. Обрабатываем InsPLAD-det
-    stats_det = {'processed': 0, 'by_class': defaultdict(int)}
-    if insplad_det_dir.exists():
-        stats_det = process_insplad_det(insplad_det_dir, temp_dir)
-    else:
-        print("\n⚠️ InsPLAD-det не найден, пропускаем")
-
-    # 2. Копируем fault dataset
-    stats_fault = {'processed': 0, 'by_class': defaultdict(int)}
-    if fault_dir.exists():
-        stats_fault = merge_fault_dataset(fault_dir, temp_dir)
-    else:
-        print("\n⚠️ insplad_fault_with_bbox не найден, пропускаем")
-
-    # 3. Объединяем с существующим dataset_8classes
-    print("\n" + "="*60)
-    print("📦 Финальное объединение...")
-    print("="*60)
-
-    merge_with_existing_dataset(temp_dir, final_dir)
-
-    # 4. Копируем YAML конфиг
-    yaml_source = base_dir / 'dataset_8classes.yaml'
-    yaml_target = final_dir / 'dataset_8classes.yaml'
-    if yaml_source.exists() and not yaml_target.exists():
-        shutil.copy2(yaml_source, yaml_target)
-
-    # 5. Удаляем временную папку
-    print("\n🗑️ Очистка временных файлов...")
-    shutil.rmtree(temp_dir)
+    tar = None
+    if args.archive:
+        # Один поток tar.gz вместо десятков тысяч мелких файлов на диске:
+        # сначала существующий dataset_8classes, затем InsPLAD данные
+        print(f"📦 Запись в архив: {args.archive}")
+        tar = tarfile.open(args.archive, 'w|gz')
+        if final_dir.exists():
+            tar.add(final_dir, arcname=final_dir.as_posix())
+    elif not final_dir.exists():
+        # InsPLAD данные пишутся сразу в dataset_8classes, без временной папки
+        print(f"⚠️ {final_dir} не существует, создаём новый")
+        final_dir.mkdir(parents=True)
+
+    try:
+        # 1. Обрабатываем InsPLAD-det
+        stats_det = {'processed': 0, 'by_class': Counter()}
+        if insplad_det_dir.exists():
+            stats_det = process_insplad_det(insplad_det_dir, final_dir, tar)
+        else:
+            print("\n⚠️ InsPLAD-det не найден, пропускаем")
+
+        # 2. Копируем fault dataset
+        stats_fault = {'processed': 0, 'by_class': Counter()}
+        if fault_dir.exists():
+            stats_fault = merge_fault_dataset(fault_dir, final_dir, tar)
+        else:
+            print("\n⚠️ insplad_fault_with_bbox не найден, пропускаем")
+
+        # 3. Копируем YAML конфиг
+        yaml_source = base_dir / 'dataset_8classes.yaml'
+        yaml_target = final_dir / 'dataset_8classes.yaml'
+        if yaml_source.exists() and not yaml_target.exists():
+            if tar is None:
+                shutil.copy2(yaml_source, yaml_target)
+            else:
+                store_file(yaml_source, yaml_target, tar)
+    finally:
+        if tar is not None:
+            tar.close()
 
     # ФИНАЛЬНАЯ СТАТИСТИКА
     print("\n" + "="*60)
@@ -327,12 +460,18 @@ def main():
         name = fault_names.get(class_id, 'unknown')
         print(f"   Класс {class_id} ({name:25s}): +{count:5d}")
 
+    if tar is not None:
+        print(f"\n📂 Результат: {args.archive}")
+        print("\n💡 СЛЕДУЮЩИЕ ШАГИ:")
+        print("   1. Загрузить в Google Drive и обучить!")
+        return
+
     # Проверяем финальную статистику
     print(f"\n📊 ФИНАЛЬНЫЙ ДАТАСЕТ:")
     for split in ['train', 'val', 'test']:
         split_dir = final_dir / 'images' / split
         if split_dir.exists():
-            count = len(list(split_dir.glob('*.jpg')))
+            count = sum(1 for _ in iter_files(split_dir, '.jpg'))
             print(f"   {split:6s}: {count:5d} images")
 
     print(f"\n📂 Результат: {final_dir}/")
@@ -10,11 +10,21 @@
 """
 
 from pathlib import Path
-import shutil
+import io
+import os
 import random
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 import argparse
 
+import numpy as np
+from tqdm import tqdm
+
+import fileops
+
+
+YOLO_LINE_FORMAT = "%d %.6f %.6f %.6f %.6f"
 
 # Маппинг имён классов из внешних датасетов → ваши классы
 CLASS_MAPPING = {
@@ -61,67 +71,229 @@ CLASS_MAPPING = {
 }
 
 
-def remap_label_file(label_path: Path, class_mapping_dict: dict, 
-                     external_class_names: dict) -> list[str]:
+def build_class_lut(class_mapping_dict: dict, external_class_names: dict) -> np.ndarray:
     """
-    Перемаппивает class IDs в label файле
+    Таблица external_id → ваш ID (-1 - класс не нужен), строится один раз на датасет
     
     Args:
-        label_path: Путь к label файлу
         class_mapping_dict: Маппинг имён классов → ваш ID
         external_class_names: {external_id: external_name}
+    """
+    lut = np.full(max(external_class_names, default=0) + 1, -1, dtype=np.int32)
+    for external_class_id, external_class_name in external_class_names.items():
+        your_class_id = class_mapping_dict.get(external_class_name.lower())
+        if your_class_id is not None and external_class_id >= 0:
+            lut[external_class_id] = your_class_id
+    return lut
+
+
+def remap_label_file(label_path: Path, class_lut: np.ndarray) -> tuple[list[int], bytes]:
+    """
+    Перемаппивает class IDs в label файле
+    
+    Файл разбирается одним вызовом np.loadtxt, классы перемаппиваются через
+    таблицу class_lut, координаты обрезаются одним np.clip.
+    
+    Args:
+        label_path: Путь к label файлу
+        class_lut: Таблица external_id → ваш ID из build_class_lut
     
     Returns:
-        Список строк для нового label файла (или пустой, если нет подходящих классов)
+        (ваши class_id, содержимое нового label в bytes);
+        пустой список, если нет подходящих классов
     """
     try:
         with open(label_path, 'r') as f:
             lines = f.readlines()
         
-        remapped_lines = []
+        if not any(line.strip() for line in lines):
+            return [], b''
         
-        for line in lines:
-            line = line.strip()
-            if not line:
-                continue
-            
-            parts = line.split()
-            if len(parts) < 5:
-                continue
-            
-            external_class_id = int(parts[0])
-            coords = parts[1:5]
-            
-            # Получаем имя внешнего класса
-            external_class_name = external_class_names.get(external_class_id, '').lower()
-            
-            # Маппим на ваш класс
-            your_class_id = class_mapping_dict.get(external_class_name)
-            
-            if your_class_id is not None:
-                # Проверяем координаты
-                try:
-                    coords_float = [float(c) for c in coords]
-                    # Clamp to [0, 1]
-                    coords_float = [max(0.0, min(1.0, c)) for c in coords_float]
-                    
-                    remapped_line = f"{your_class_id} {' '.join(f'{c:.6f}' for c in coords_float)}\n"
-                    remapped_lines.append(remapped_line)
-                except ValueError:
-                    continue
+        try:
+            boxes = np.loadtxt(lines, ndmin=2)
+        except ValueError:
+            # Неполные или нечисловые строки - построчная обработка
+            return remap_label_lines(lines, class_lut)
+        
+        if boxes.size == 0 or boxes.shape[1] < 5:
+            return [], b''
+        
+        external_ids = boxes[:, 0].astype(np.int64)
+        in_range = (external_ids >= 0) & (external_ids < len(class_lut))
+        your_ids = np.full(len(external_ids), -1, dtype=np.int32)
+        your_ids[in_range] = class_lut[external_ids[in_range]]
+        keep = your_ids >= 0
         
-        return remapped_lines
+        # Clamp to [0, 1]
+        coords = np.clip(boxes[keep, 1:5], 0.0, 1.0)
+        
+        # Весь label форматируется в один буфер и потом пишется одним write
+        buf = io.BytesIO()
+        np.savetxt(buf, np.column_stack([your_ids[keep], coords]), fmt=YOLO_LINE_FORMAT)
+        return your_ids[keep].tolist(), buf.getvalue()
     
     except Exception as e:
         print(f"❌ Ошибка обработки {label_path}: {e}")
-        return []
+        return [], b''
+
+
+def remap_label_lines(lines: list[str], class_lut: np.ndarray) -> tuple[list[int], bytes]:
+    """Построчный remap (для файлов с некорректными строками)"""
+    class_ids = []
+    remapped_lines = []
+    
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        
+        parts = line.split()
+        if len(parts) < 5:
+            continue
+        
+        external_class_id = int(parts[0])
+        coords = parts[1:5]
+        
+        # Маппим на ваш класс
+        your_class_id = -1
+        if 0 <= external_class_id < len(class_lut):
+            your_class_id = int(class_lut[external_class_id])
+        
+        if your_class_id >= 0:
+            # Проверяем координаты
+            try:
+                x, y, w, h = [float(c) for c in coords]
+                # Clamp to [0, 1]
+                x = max(0.0, min(1.0, x))
+                y = max(0.0, min(1.0, y))
+                w = max(0.0, min(1.0, w))
+                h = max(0.0, min(1.0, h))
+                
+                # Одна f-строка на bbox, без genexpr и ' '.join
+                remapped_line = f"{your_class_id} {x:.6f} {y:.6f} {w:.6f} {h:.6f}\n"
+                remapped_lines.append(remapped_line)
+                class_ids.append(your_class_id)
+            except ValueError:
+                continue
+    
+    return class_ids, ''.join(remapped_lines).encode()
+
+
+def hardlink_image(src, dst):
+    """Hardlink на исходное изображение; существующий dst заменяется, как при копировании"""
+    try:
+        os.link(src, dst)
+    except FileExistsError:
+        os.unlink(dst)
+        os.link(src, dst)
+
+
+def symlink_image(src, dst):
+    """Symlink на исходное изображение (абсолютный путь, чтобы не зависеть от cwd)"""
+    src = os.path.abspath(src)
+    try:
+        os.symlink(src, dst)
+    except FileExistsError:
+        os.unlink(dst)
+        os.symlink(src, dst)
+
+
+def _has_entry(path: Path) -> bool:
+    """Есть ли в папке хоть одна запись (scandir останавливается на первой)"""
+    with os.scandir(path) as it:
+        return next(it, None) is not None
+
+
+def build_label_index(label_roots: list[Path]) -> dict:
+    """
+    Индекс label файлов за один os.scandir каждой папки
+    
+    Ключи: (root, split, stem) для root/split/stem.txt и (root, None, stem)
+    для root/stem.txt, значения - пути. Заменяет exists() на каждый вариант пути.
+    """
+    label_index = {}
+    
+    for root in label_roots:
+        if not root.is_dir():
+            continue
+        
+        with os.scandir(root) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.endswith('.txt'):
+                    label_index[(root, None, entry.name[:-len('.txt')])] = entry.path
+                elif entry.name in ('train', 'val', 'test') and entry.is_dir():
+                    with os.scandir(entry.path) as split_it:
+                        for split_entry in split_it:
+                            if split_entry.is_file() and split_entry.name.endswith('.txt'):
+                                label_index[(root, entry.name, split_entry.name[:-len('.txt')])] = split_entry.path
+    
+    return label_index
+
+
+def add_external_image(img_path: Path,
+                       split_name: str,
+                       external_name: str,
+                       label_roots: list[Path],
+                       label_index: dict,
+                       target_img_dir: str,
+                       target_label_dir: str,
+                       class_lut: np.ndarray,
+                       copy_image=fileops.fastcopy):
+    """
+    Добавляет одно изображение внешнего датасета (выполняется в пуле потоков)
+    
+    Returns:
+        {ваш class_id: количество объектов} или None, если изображение пропущено
+    """
+    # Имя и stem считаются один раз (каждый Path.name/.stem заново разбирает путь)
+    img_name = img_path.name
+    img_stem = img_name[:img_name.rindex('.')] if '.' in img_name else img_name
+    
+    # Ищем соответствующий label
+    # Может быть в labels/ или labels/train/ etc (порядок как у прежнего перебора путей)
+    label_path = None
+    for root in label_roots:
+        label_path = (label_index.get((root, split_name, img_stem))
+                      or label_index.get((root, None, img_stem)))
+        if label_path:
+            break
+    
+    if not label_path:
+        return None
+    
+    # Перемаппиваем label
+    class_ids, label_data = remap_label_file(label_path, class_lut)
+    
+    if not class_ids:
+        return None
+    
+    # Генерируем уникальное имя
+    # (os.path.join вместо Path / - без нового PurePath на каждый файл)
+    unique_name = f"ext_{external_name}_{img_name}"
+    target_img_path = os.path.join(target_img_dir, unique_name)
+    target_label_path = os.path.join(target_label_dir, os.path.splitext(unique_name)[0] + '.txt')
+    
+    # Копируем изображение
+    copy_image(img_path, target_img_path)
+    
+    # Сохраняем remapped label одним write (binary: без перевода newline)
+    with open(target_label_path, 'wb') as f:
+        f.write(label_data)
+    
+    # Статистика (локальная, сливается в главном потоке)
+    class_counts = defaultdict(int)
+    for class_id in class_ids:
+        class_counts[class_id] += 1
+    
+    return class_counts
 
 
 def merge_external_dataset(external_dir: Path, 
                            your_dataset_dir: Path,
                            external_class_names: dict,
                            train_split: float = 0.8,
-                           val_split: float = 0.15):
+                           val_split: float = 0.15,
+                           link_mode: str = None):
     """
     Добавляет внешний датасет в ваш dataset_8classes
     
@@ -131,6 +303,8 @@ def merge_external_dataset(external_dir: Path,
         external_class_names: Маппинг {class_id: class_name} для внешнего датасета
         train_split: Доля для train (по умолчанию 80%)
         val_split: Доля для val (по умолчанию 15%, остальное - test)
+        link_mode: None - копировать изображения, 'hardlink' - os.link
+            (только на одной ФС), 'symlink' - os.symlink
     """
     
     print("\n" + "="*70)
@@ -152,11 +326,23 @@ def merge_external_dataset(external_dir: Path,
         print(f"❌ Не найдена папка labels: {external_labels}")
         return
     
+    # Чем переносить изображения: hardlink/symlink не копируют ни байта данных
+    copy_image = fileops.fastcopy
+    if link_mode == 'hardlink':
+        if os.stat(external_dir).st_dev == os.stat(your_dataset_dir).st_dev:
+            copy_image = hardlink_image
+        else:
+            print("⚠️ --link: датасеты на разных файловых системах, изображения будут скопированы")
+    elif link_mode == 'symlink':
+        copy_image = symlink_image
+    
     # Собираем все изображения из внешнего датасета
     all_images = []
     
     # Проверяем структуру: images/ может содержать train/val/test или файлы напрямую
-    if list((external_images / 'train').glob('*')) if (external_images / 'train').exists() else []:
+    train_images = external_images / 'train'
+    split_structure = train_images.is_dir() and _has_entry(train_images)
+    if split_structure:
         # Структура с split
         for split in ['train', 'val', 'test']:
             split_dir = external_images / split
@@ -202,63 +388,55 @@ def merge_external_dataset(external_dir: Path,
         'by_class': defaultdict(int)
     }
     
+    # Имена классов → ваши ID один раз на весь датасет, а не на каждый файл
+    class_lut = build_class_lut(CLASS_MAPPING, external_class_names)
+    
+    # Где искать labels: external/labels, затем labels рядом с папкой изображений
+    # (для структуры с split это images/labels, для плоской - снова external/labels)
+    images_parent = external_images if split_structure else external_dir
+    label_roots = list(dict.fromkeys([external_labels, images_parent / 'labels']))
+    label_index = build_label_index(label_roots)
+    
+    # Имя внешнего датасета не меняется - в уникальные имена идёт готовая строка
+    external_name = external_dir.name
+    
     # Обрабатываем каждый split
     for split_name, images in splits.items():
         print(f"🔄 Обработка {split_name}...")
         
-        target_img_dir = your_dataset_dir / 'images' / split_name
-        target_label_dir = your_dataset_dir / 'labels' / split_name
+        # Папки split создаются один раз, в воркеры уходят готовые строки путей
+        target_img_dir = str(your_dataset_dir / 'images' / split_name)
+        target_label_dir = str(your_dataset_dir / 'labels' / split_name)
         
-        target_img_dir.mkdir(parents=True, exist_ok=True)
-        target_label_dir.mkdir(parents=True, exist_ok=True)
+        os.makedirs(target_img_dir, exist_ok=True)
+        os.makedirs(target_label_dir, exist_ok=True)
         
-        for img_path in images:
-            # Ищем соответствующий label
-            # Может быть в labels/ или labels/train/ etc
-            label_name = img_path.stem + '.txt'
-            
-            possible_label_paths = [
-                external_labels / split_name / label_name,
-                external_labels / label_name,
-                img_path.parent.parent / 'labels' / split_name / label_name,
-                img_path.parent.parent / 'labels' / label_name,
-            ]
-            
-            label_path = None
-            for p in possible_label_paths:
-                if p.exists():
-                    label_path = p
-                    break
-            
-            if not label_path:
-                stats['skipped'] += 1
-                continue
-            
-            # Перемаппиваем label
-            remapped_lines = remap_label_file(label_path, CLASS_MAPPING, external_class_names)
-            
-            if not remapped_lines:
-                stats['skipped'] += 1
-                continue
-            
-            # Генерируем уникальное имя
-            unique_name = f"ext_{external_dir.name}_{img_path.name}"
-            target_img_path = target_img_dir / unique_name
-            target_label_path = target_label_dir / (Path(unique_name).stem + '.txt')
-            
-            # Копируем изображение
-            shutil.copy2(img_path, target_img_path)
-            
-            # Сохраняем remapped label
-            with open(target_label_path, 'w') as f:
-                f.writelines(remapped_lines)
-            
-            # Статистика
-            for line in remapped_lines:
-                class_id = int(line.split()[0])
-                stats['by_class'][class_id] += 1
-            
-            stats['added'] += 1
+        worker = partial(
+            add_external_image,
+            split_name=split_name,
+            external_name=external_name,
+            label_roots=label_roots,
+            label_index=label_index,
+            target_img_dir=target_img_dir,
+            target_label_dir=target_label_dir,
+            class_lut=class_lut,
+            copy_image=copy_image
+        )
+        
+        # Копирование и запись label - I/O, поэтому пул потоков;
+        # статистика собирается только здесь, в главном потоке
+        with ThreadPoolExecutor(max_workers=fileops.IO_WORKERS) as executor:
+            # tqdm обновляет строку прогресса не чаще раза в mininterval, а не на каждое изображение
+            progress = tqdm(executor.map(worker, images), total=len(images), desc=split_name, mininterval=0.5)
+            for class_counts in progress:
+                if class_counts is None:
+                    stats['skipped'] += 1
+                    continue
+                
+                for class_id, count in class_counts.items():
+                    stats['by_class'][class_id] += count
+                
+                stats['added'] += 1
         
         print(f"   ✓ Добавлено: {stats['added']} images")
     
@@ -302,6 +480,11 @@ def main():
                        help='Доля train (по умолчанию 0.8)')
     parser.add_argument('--val-split', type=float, default=0.15, 
                        help='Доля val (по умолчанию 0.15)')
+    link_group = parser.add_mutually_exclusive_group()
+    link_group.add_argument('--link', dest='link_mode', action='store_const', const='hardlink',
+                           help='Hardlink изображений вместо копирования (если на одной ФС)')
+    link_group.add_argument('--symlink', dest='link_mode', action='store_const', const='symlink',
+                           help='Symlink на исходные изображения вместо копирования')
     
     args = parser.parse_args()
     
@@ -334,7 +517,8 @@ def main():
         your_dataset_dir, 
         external_class_names,
         args.train_split,
-        args.val_split
+        args.val_split,
+        args.link_mode
     )
 
 
@@ -3,10 +3,22 @@
 Использует простое random разделение на train/val/test
 """
 import os
+import re
 import shutil
 from pathlib import Path
-from collections import defaultdict
-import random
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import numpy as np
+
+import fileops
+
+# Все поддерживаемые расширения изображений (для str.endswith по имени в нижнем регистре)
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.tiff', '.bmp')
+
+# Подкаталоги real_dataset без изображений: при поиске изображений не обходятся
+IMAGE_SCAN_PRUNED_DIRS = frozenset({'labels', '.git', '__pycache__', 'runs'})
 
 # Маппинг старых классов (6) в новые (8)
 # Сначала нужно переконвертировать dataset/ чтобы включить nest и safety_sign!
@@ -21,47 +33,156 @@ CLASS_MAPPING = {
     7: 7,  # safety_sign -> safety_sign (НОВЫЙ)
 }
 
-def get_image_extensions():
-    """Все поддерживаемые расширения изображений"""
-    return ['.jpg', '.JPG', '.jpeg', '.JPEG', '.png', '.PNG', '.tiff', '.TIFF', '.bmp', '.BMP']
+# Пока маппинг тождественный, корректная метка переписывается без изменений
+CLASS_MAPPING_IS_IDENTITY = all(old == new for old, new in CLASS_MAPPING.items())
+
+# Метка целиком из строк "класс из CLASS_MAPPING + минимум 4 значения" (пустые строки допускаются)
+_LABEL_LINE = (rb'[ \t]*(?:' + b'|'.join(b'%d' % c for c in CLASS_MAPPING) +
+               rb')(?:[ \t]+\S+){4,}[ \t]*')
+IDENTITY_LABEL_RE = re.compile(rb'(?:(?:' + _LABEL_LINE + rb')?\r?\n)*(?:' + _LABEL_LINE + rb')?')
+
+# class_id в начале каждой строки метки
+LABEL_CLASS_RE = re.compile(rb'^[ \t]*(\d+)', re.M)
+
+def link_or_copy(src, dst):
+    """
+    Hardlink на исходное изображение, а если нельзя (другая ФС, нет прав,
+    лимит ссылок) - fileops.fastcopy. Hardlink не копирует ни байта данных.
+    """
+    try:
+        os.link(src, dst)
+    except OSError:
+        fileops.fastcopy(src, dst)
+
+def _scandir_recursive(path, pruned_dirs=frozenset()):
+    """
+    Рекурсивный обход через os.scandir: все файлы (os.DirEntry) внутри path
+    
+    Тип записи берётся из dirent, поэтому is_dir()/is_file() не делают stat,
+    в отличие от Path.rglob, который создаёт Path и проверяет каждую запись.
+    Подкаталоги с именами из pruned_dirs не обходятся вовсе.
+    """
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                if entry.name not in pruned_dirs:
+                    yield from _scandir_recursive(entry.path, pruned_dirs)
+            elif entry.is_file():
+                yield entry
 
-def find_matching_label(image_path, labels_dir):
-    """Поиск соответствующего label файла для изображения"""
-    image_name = image_path.stem
+def build_label_index(labels_dir):
+    """
+    Индекс label файлов за один обход labels_dir
+    
+    Returns:
+        (label_by_stem, label_by_stem_lower): stem -> путь и stem.lower() -> путь
+        (при одинаковых именах побеждает первый найденный файл, как и при rglob)
+    """
+    label_by_stem = {}
+    label_by_stem_lower = {}
+    
+    for entry in _scandir_recursive(labels_dir):
+        if entry.name.endswith('.txt'):
+            label_stem = entry.name[:-len('.txt')]
+            label_by_stem.setdefault(label_stem, entry.path)
+            label_by_stem_lower.setdefault(label_stem.lower(), entry.path)
+    
+    return label_by_stem, label_by_stem_lower
+
+def find_matching_label(image_stem, label_by_stem, label_by_stem_lower):
+    """Поиск соответствующего label файла для изображения по индексу из build_label_index"""
+    # Точное совпадение имени - O(1)
+    label_file = label_by_stem.get(image_stem)
+    if label_file is not None:
+        return label_file
     
-    # Ищем рекурсивно
-    for label_file in labels_dir.rglob(f"{image_name}.txt"):
+    # Совпадение без учёта регистра - тоже O(1)
+    image_stem_lower = image_stem.lower()
+    label_file = label_by_stem_lower.get(image_stem_lower)
+    if label_file is not None:
         return label_file
     
-    # Если не нашли, пробуем поиск по части имени
-    for label_file in labels_dir.rglob("*.txt"):
-        if image_name.lower() in label_file.stem.lower():
+    # Если не нашли, пробуем поиск по части имени (линейный проход только для промахов)
+    for label_stem_lower, label_file in label_by_stem_lower.items():
+        if image_stem_lower in label_stem_lower:
             return label_file
     
     return None
 
 def convert_label_classes(label_path, class_mapping):
-    """Конвертация классов в label файле"""
-    new_labels = []
-    
-    with open(label_path, 'r') as f:
-        for line in f:
-            parts = line.strip().split()
-            if len(parts) < 5:
-                continue
-            
-            old_class = int(parts[0])
-            
-            if old_class in class_mapping:
-                new_class = class_mapping[old_class]
-                new_line = f"{new_class} {' '.join(parts[1:])}\n"
-                new_labels.append(new_line)
+    """
+    Конвертация классов в label файле
+    
+    Файл читается целиком в bytes и разбирается без текстового декодирования
+    и построчного чтения; результат собирается в один буфер для одной записи.
+    
+    Returns:
+        (список новых class_id, содержимое новой метки в bytes)
+    """
+    with open(label_path, 'rb') as f:
+        data = f.read()
+    
+    # Быстрый путь: при тождественном маппинге корректная метка не меняется,
+    # нужны только class_id для статистики - без split/join по строкам
+    if class_mapping is CLASS_MAPPING and CLASS_MAPPING_IS_IDENTITY and IDENTITY_LABEL_RE.fullmatch(data):
+        new_class_ids = [int(c) for c in LABEL_CLASS_RE.findall(data)]
+        if new_class_ids and not data.endswith(b'\n'):
+            data += b'\n'
+        return new_class_ids, data
+    
+    new_class_ids = []
+    new_labels = bytearray()
+    
+    for line in data.split(b'\n'):
+        parts = line.split()
+        if len(parts) < 5:
+            continue
+        
+        old_class = int(parts[0])
+        
+        if old_class in class_mapping:
+            new_class = class_mapping[old_class]
+            new_class_ids.append(new_class)
+            new_labels += b'%d %s\n' % (new_class, b' '.join(parts[1:]))
     
-    return new_labels
+    return new_class_ids, bytes(new_labels)
 
-def prepare_dataset(real_dataset_dir, old_labels_dir, output_dir, train_ratio=0.8, val_ratio=0.1, test_ratio=0.1, random_seed=42):
-    """Подготовка датасета для 8 классов"""
-    random.seed(random_seed)
+def copy_image_with_label(item, img_dir, label_dir, copy_image=fileops.fastcopy):
+    """
+    Копирует изображение и конвертирует его метку (выполняется в пуле потоков)
+    
+    Returns:
+        Список class_id записанной метки (по одному на аннотацию) или None,
+        если в ней нет нужных классов
+    """
+    img_path, label_path = item
+    
+    # Копируем изображение
+    img_name = os.path.basename(img_path)
+    img_dst = os.path.join(img_dir, img_name)
+    copy_image(img_path, img_dst)
+    
+    # Конвертируем метку
+    new_class_ids, new_labels = convert_label_classes(label_path, CLASS_MAPPING)
+    
+    if len(new_class_ids) == 0:
+        return None
+    
+    label_dst = os.path.join(label_dir, os.path.splitext(img_name)[0] + '.txt')
+    with open(label_dst, 'wb') as f:
+        f.write(new_labels)
+    
+    # Статистика по классам считается из уже разобранной метки, без повторного чтения
+    return new_class_ids
+
+def prepare_dataset(real_dataset_dir, old_labels_dir, output_dir, train_ratio=0.8, val_ratio=0.1, test_ratio=0.1, random_seed=42, link_images=True):
+    """
+    Подготовка датасета для 8 классов
+    
+    link_images: изображения не копируются, а hardlink-уются из real_dataset
+    (real_dataset только читается, поэтому общие inode безопасны)
+    """
+    rng = np.random.default_rng(random_seed)
     
     real_dataset_path = Path(real_dataset_dir)
     old_labels_path = Path(old_labels_dir)
@@ -81,21 +202,24 @@ def prepare_dataset(real_dataset_dir, old_labels_dir, output_dir, train_ratio=0.
     # Собираем изображения
     print("\n🔍 Сканирование изображений в real_dataset...")
     all_images = []
-    extensions = get_image_extensions()
     
-    for img_file in real_dataset_path.rglob("*"):
-        if img_file.is_file() and img_file.suffix in extensions:
-            all_images.append(img_file)
+    for entry in _scandir_recursive(real_dataset_path, IMAGE_SCAN_PRUNED_DIRS):
+        if entry.name.lower().endswith(IMAGE_EXTENSIONS):
+            all_images.append(entry.path)
     
     print(f"   Найдено изображений: {len(all_images)}")
     
+    # Все label индексируются одним обходом
+    label_by_stem, label_by_stem_lower = build_label_index(old_labels_path)
+    
     # Фильтруем изображения с метками
     print("\n🏷️  Поиск соответствующих меток...")
     images_with_labels = []
     images_without_labels = []
     
     for img_path in all_images:
-        label_path = find_matching_label(img_path, old_labels_path)
+        img_stem = os.path.splitext(os.path.basename(img_path))[0]
+        label_path = find_matching_label(img_stem, label_by_stem, label_by_stem_lower)
         if label_path:
             images_with_labels.append((img_path, label_path))
         else:
@@ -108,17 +232,17 @@ def prepare_dataset(real_dataset_dir, old_labels_dir, output_dir, train_ratio=0.
         print("\n❌ ОШИБКА: Не найдено изображений с соответствующими метками!")
         return
     
-    # Простое random разделение
+    # Простое random разделение: перемешиваются индексы, а не сами пары путей
     print("\n📊 Разделение на train/val/test...")
-    random.shuffle(images_with_labels)
-    
     total = len(images_with_labels)
+    order = rng.permutation(total)
+    
     train_end = int(total * train_ratio)
     val_end = train_end + int(total * val_ratio)
     
-    train_data = images_with_labels[:train_end]
-    val_data = images_with_labels[train_end:val_end]
-    test_data = images_with_labels[val_end:]
+    train_data = [images_with_labels[i] for i in order[:train_end]]
+    val_data = [images_with_labels[i] for i in order[train_end:val_end]]
+    test_data = [images_with_labels[i] for i in order[val_end:]]
     
     splits = {
         'train': train_data,
@@ -134,28 +258,32 @@ def prepare_dataset(real_dataset_dir, old_labels_dir, output_dir, train_ratio=0.
     print("\n📦 Копирование файлов и конвертация меток...")
     
     stats = {'total': 0, 'converted': 0, 'skipped': 0}
-    
-    for split_name, data in splits.items():
-        print(f"\n   {split_name}:")
-        for img_path, label_path in data:
-            # Копируем изображение
-            img_dst = output_path / 'images' / split_name / img_path.name
-            shutil.copy2(img_path, img_dst)
+    class_counts = Counter()
+    
+    # Копирование и запись меток - I/O, поэтому один пул потоков на все split
+    # (без пересоздания потоков); счётчики обновляются только в главном потоке
+    copy_image = link_or_copy if link_images else fileops.fastcopy
+    with ThreadPoolExecutor(max_workers=fileops.IO_WORKERS) as executor:
+        for split_name, data in splits.items():
+            print(f"\n   {split_name}:")
+            # Папки split - строки, собранные один раз: в потоках пути склеиваются без Path
+            worker = partial(
+                copy_image_with_label,
+                img_dir=os.fspath(output_path / 'images' / split_name),
+                label_dir=os.fspath(output_path / 'labels' / split_name),
+                copy_image=copy_image
+            )
             
-            # Конвертируем метку
-            new_labels = convert_label_classes(label_path, CLASS_MAPPING)
+            for label_class_ids in executor.map(worker, data):
+                if label_class_ids is not None:
+                    stats['converted'] += 1
+                    class_counts.update(label_class_ids)
+                else:
+                    stats['skipped'] += 1
+                
+                stats['total'] += 1
             
-            if len(new_labels) > 0:
-                label_dst = output_path / 'labels' / split_name / (img_path.stem + '.txt')
-                with open(label_dst, 'w') as f:
-                    f.writelines(new_labels)
-                stats['converted'] += 1
-            else:
-                stats['skipped'] += 1
-            
-            stats['total'] += 1
-        
-        print(f"      Обработано: {len(data)} файлов")
+            print(f"      Обработано: {len(data)} файлов")
     
     print(f"\n✅ Подготовка датасета завершена!")
     print(f"   Всего обработано: {stats['total']}")
@@ -165,18 +293,6 @@ def prepare_dataset(real_dataset_dir, old_labels_dir, output_dir, train_ratio=0.
     
     # Статистика по классам
     print("\n📈 Статистика по классам:")
-    class_counts = defaultdict(int)
-    
-    for split_name in ['train', 'val', 'test']:
-        label_dir = output_path / 'labels' / split_name
-        for label_file in label_dir.glob('*.txt'):
-            with open(label_file, 'r') as f:
-                for line in f:
-                    parts = line.strip().split()
-                    if len(parts) >= 5:
-                        class_id = int(parts[0])
-                        class_counts[class_id] += 1
-    
     for class_id in sorted(class_counts.keys()):
         print(f"   Класс {class_id}: {class_counts[class_id]} аннотаций")
 
@@ -23,6 +23,9 @@ def upgrade() -> None:
     # Затем добавляем новые значения
     op.execute("""
         DO $$ 
+        DECLARE
+            existing text[];
+            v text;
         BEGIN
             -- Проверяем существование enum типа
             IF NOT EXISTS (SELECT 1 FROM pg_type WHERE typname = 'filetype') THEN
@@ -39,38 +42,22 @@ def upgrade() -> None:
                     'ANALYSIS_ARCHIVE'
                 );
             ELSE
-                -- Enum уже существует, добавляем только новые значения
-                IF NOT EXISTS (
-                    SELECT 1 FROM pg_enum 
-                    WHERE enumlabel = 'ANALYSIS_ORIGINAL' 
-                    AND enumtypid = (SELECT oid FROM pg_type WHERE typname = 'filetype')
-                ) THEN
-                    ALTER TYPE filetype ADD VALUE 'ANALYSIS_ORIGINAL';
-                END IF;
-                
-                IF NOT EXISTS (
-                    SELECT 1 FROM pg_enum 
-                    WHERE enumlabel = 'ANALYSIS_PREVIEW' 
-                    AND enumtypid = (SELECT oid FROM pg_type WHERE typname = 'filetype')
-                ) THEN
-                    ALTER TYPE filetype ADD VALUE 'ANALYSIS_PREVIEW';
-                END IF;
-                
-                IF NOT EXISTS (
-                    SELECT 1 FROM pg_enum 
-                    WHERE enumlabel = 'ANALYSIS_RESULT' 
-                    AND enumtypid = (SELECT oid FROM pg_type WHERE typname = 'filetype')
-                ) THEN
-                    ALTER TYPE filetype ADD VALUE 'ANALYSIS_RESULT';
-                END IF;
-                
-                IF NOT EXISTS (
-                    SELECT 1 FROM pg_enum 
-                    WHERE enumlabel = 'ANALYSIS_ARCHIVE' 
-                    AND enumtypid = (SELECT oid FROM pg_type WHERE typname = 'filetype')
-                ) THEN
-                    ALTER TYPE filetype ADD VALUE 'ANALYSIS_ARCHIVE';
-                END IF;
+                -- Enum уже существует: читаем его значения одним запросом
+                -- и добавляем только отсутствующие
+                existing := ARRAY(
+                    SELECT enumlabel FROM pg_enum
+                    WHERE enumtypid = (SELECT oid FROM pg_type WHERE typname = 'filetype')
+                );
+                FOREACH v IN ARRAY ARRAY[
+                    'ANALYSIS_ORIGINAL',
+                    'ANALYSIS_PREVIEW',
+                    'ANALYSIS_RESULT',
+                    'ANALYSIS_ARCHIVE'
+                ] LOOP
+                    IF NOT v = ANY(existing) THEN
+                        EXECUTE format('ALTER TYPE filetype ADD VALUE %L', v);
+                    END IF;
+                END LOOP;
             END IF;
         END $$;
     """)
@@ -0,0 +1,36 @@
+"""add files (project_id, created_at, id) index
+
+Revision ID: 002
+Revises: 001
+Create Date: 2026-10-16 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '002'
+down_revision: Union[str, None] = '001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # На новой БД таблицу files (вместе с индексом) создаёт Base.metadata.create_all
+    # при старте приложения, поэтому индекс добавляется только в существующую таблицу
+    if not sa.inspect(op.get_bind()).has_table('files'):
+        return
+
+    op.create_index(
+        'idx_files_project_created',
+        'files',
+        ['project_id', sa.text('created_at DESC'), sa.text('id DESC')],
+        if_not_exists=True
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('idx_files_project_created', table_name='files', if_exists=True)
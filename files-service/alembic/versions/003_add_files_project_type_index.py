@@ -0,0 +1,39 @@
+"""add files (project_id, file_type) index
+
+Revision ID: 003
+Revises: 002
+Create Date: 2026-10-16 13:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '003'
+down_revision: Union[str, None] = '002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # На новой БД таблицу files (вместе с индексами) создаёт Base.metadata.create_all
+    # при старте приложения, поэтому индексы меняются только в существующей таблице
+    if not sa.inspect(op.get_bind()).has_table('files'):
+        return
+
+    op.create_index(
+        'idx_files_project_type',
+        'files',
+        ['project_id', 'file_type'],
+        if_not_exists=True
+    )
+    # project_id - префикс idx_files_project_type и idx_files_project_created
+    op.drop_index('ix_files_project_id', table_name='files', if_exists=True)
+
+
+def downgrade() -> None:
+    op.create_index('ix_files_project_id', 'files', ['project_id'], if_not_exists=True)
+    op.drop_index('idx_files_project_type', table_name='files', if_exists=True)
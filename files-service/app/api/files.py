@@ -1,16 +1,47 @@
 from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, status, Form, Query, Body
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
 from sqlalchemy.orm import Session
 from uuid import UUID, uuid4
+from datetime import datetime
 from typing import Optional, List
 from pydantic import BaseModel
+import asyncio
 import base64
+import io
+import json
+import os
+import time
+import zipfile
 from app.database import get_db
 from app.schemas import FileUploadResponse, FileResponse as FileResponseSchema, FileListResponse, FileType, BatchFileUploadResponse
 from app.services.storage import StorageService
+from app.services.cache import project_cache
 import app.crud as crud
 from app.models import FileType as FileTypeEnum
 
+# Размер блока чтения для base64 в batch-download (кратен 3)
+BASE64_CHUNK_SIZE = 3 * 256 * 1024
+
+# Размер блока чтения для batch-download-zip
+ZIP_CHUNK_SIZE = 1024 * 1024
+
+# mime type, если клиент не передал content type
+DEFAULT_MIME_TYPE = "application/octet-stream"
+
+# Сколько файлов batch-upload сохраняется на диск одновременно
+BATCH_UPLOAD_CONCURRENCY = 16
+
+# Размер страницы keyset-пагинации списка файлов, если limit не задан
+KEYSET_PAGE_SIZE = 100
+
+# Допустимые file_type: вычисляются один раз, а не на каждый запрос
+ALLOWED_FILE_TYPES = frozenset(ft.value for ft in FileTypeEnum)
+INVALID_FILE_TYPE_DETAIL = f"Invalid file_type. Must be one of: {[ft.value for ft in FileTypeEnum]}"
+
+class LargeChunkFileResponse(FileResponse):
+    """FileResponse с блоком 1 MB вместо 64 KB: меньше чтений и переключений event loop"""
+    chunk_size = 1024 * 1024
+
 class BatchDownloadRequest(BaseModel):
     file_ids: List[str]
 
@@ -29,10 +60,10 @@ async def upload_file(
     try:
         project_uuid = UUID(project_id)
 
-        if file_type not in [ft.value for ft in FileTypeEnum]:
+        if file_type not in ALLOWED_FILE_TYPES:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Invalid file_type. Must be one of: {[ft.value for ft in FileTypeEnum]}"
+                detail=INVALID_FILE_TYPE_DETAIL
             )
 
         file_id = uuid4()
@@ -44,7 +75,7 @@ async def upload_file(
             file_id=file_id
         )
 
-        mime_type = file.content_type or "application/octet-stream"
+        mime_type = file.content_type or DEFAULT_MIME_TYPE
 
         uploaded_by_uuid = UUID(uploaded_by) if uploaded_by else None
 
@@ -99,64 +130,97 @@ async def batch_upload_files(
     try:
         project_uuid = UUID(project_id)
 
-        if file_type not in [ft.value for ft in FileTypeEnum]:
+        if file_type not in ALLOWED_FILE_TYPES:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Invalid file_type. Must be one of: {[ft.value for ft in FileTypeEnum]}"
+                detail=INVALID_FILE_TYPE_DETAIL
             )
 
         uploaded_by_uuid = UUID(uploaded_by) if uploaded_by else None
+        file_type_enum = FileTypeEnum[file_type]
         
         uploaded_files = []
         errors = []
         failed_count = 0
+        # (индекс файла в запросе, данные строки для File(**...))
+        pending_files = []
 
-        for idx, file in enumerate(files):
+        # Файлы сохраняются параллельно, но не больше BATCH_UPLOAD_CONCURRENCY сразу
+        semaphore = asyncio.Semaphore(BATCH_UPLOAD_CONCURRENCY)
+
+        async def save_one(idx: int, file: UploadFile):
             try:
                 file_id = uuid4()
 
-                file_path, file_size, checksum = await storage_service.save_file(
-                    file=file,
-                    project_id=project_uuid,
-                    file_type=file_type,
-                    file_id=file_id
-                )
-
-                mime_type = file.content_type or "application/octet-stream"
-
-                db_file = crud.create_file(
-                    db=db,
-                    file_id=file_id,
-                    project_id=project_uuid,
-                    file_name=file.filename,
-                    file_type=FileTypeEnum[file_type],
-                    file_path=file_path,
-                    file_size=file_size,
-                    mime_type=mime_type,
-                    checksum=checksum,
-                    uploaded_by=uploaded_by_uuid
-                )
-
-                uploaded_files.append(FileUploadResponse(
-                    id=str(db_file.id),
-                    project_id=str(db_file.project_id),
-                    file_name=db_file.file_name,
-                    file_type=db_file.file_type.value,
-                    file_path=db_file.file_path,
-                    file_size=db_file.file_size,
-                    mime_type=db_file.mime_type,
-                    checksum=db_file.checksum,
-                    uploaded_by=str(db_file.uploaded_by) if db_file.uploaded_by else None,
-                    created_at=db_file.created_at
-                ))
+                async with semaphore:
+                    file_path, file_size, checksum = await storage_service.save_file(
+                        file=file,
+                        project_id=project_uuid,
+                        file_type=file_type,
+                        file_id=file_id
+                    )
+
+                mime_type = file.content_type or DEFAULT_MIME_TYPE
+
+                return {
+                    "id": file_id,
+                    "project_id": project_uuid,
+                    "file_name": file.filename,
+                    "file_type": file_type_enum,
+                    "file_path": file_path,
+                    "file_size": file_size,
+                    "mime_type": mime_type,
+                    "checksum": checksum,
+                    "uploaded_by": uploaded_by_uuid
+                }, None
 
             except Exception as e:
+                return None, {
+                    "index": idx,
+                    "filename": file.filename,
+                    "error": str(e)
+                }
+
+        # gather сохраняет порядок файлов в результатах
+        results = await asyncio.gather(*(save_one(idx, file) for idx, file in enumerate(files)))
+
+        for idx, (pending, error) in enumerate(results):
+            if error is not None:
+                failed_count += 1
+                errors.append(error)
+            else:
+                pending_files.append((idx, pending))
+
+        # Все записи о сохранённых файлах - одним INSERT и одним commit
+        try:
+            db_files = crud.bulk_create_files(db, [pending for _, pending in pending_files])
+        except Exception as e:
+            db.rollback()
+            for idx, pending in pending_files:
+                storage_service.delete_file(pending["file_path"])
                 failed_count += 1
                 errors.append({
                     "index": idx,
-                    "filename": file.filename,
+                    "filename": pending["file_name"],
                     "error": str(e)
                 })
+            # Ошибки в порядке файлов запроса, как при поштучной вставке
+            errors.sort(key=lambda error: error["index"])
+            db_files = []
+
+        for db_file in db_files:
+            uploaded_files.append(FileUploadResponse(
+                id=str(db_file.id),
+                project_id=str(db_file.project_id),
+                file_name=db_file.file_name,
+                file_type=db_file.file_type.value,
+                file_path=db_file.file_path,
+                file_size=db_file.file_size,
+                mime_type=db_file.mime_type,
+                checksum=db_file.checksum,
+                uploaded_by=str(db_file.uploaded_by) if db_file.uploaded_by else None,
+                created_at=db_file.created_at
+            ))
 
         return BatchFileUploadResponse(
             files=uploaded_files,
@@ -194,10 +258,12 @@ async def download_file(
                 detail="File not found"
             )
 
-        file_path = storage_service.get_file_path(db_file.file_path)
+        # stat один раз: FileResponse не делает его повторно
+        stat_result = storage_service.stat_file(db_file.file_path)
 
-        return FileResponse(
-            path=str(file_path),
+        return LargeChunkFileResponse(
+            path=db_file.file_path,
+            stat_result=stat_result,
             filename=db_file.file_name,
             media_type=db_file.mime_type
         )
@@ -220,48 +286,149 @@ async def batch_download_files(
     request: BatchDownloadRequest = Body(...),
     db: Session = Depends(get_db)
 ):
-    """Скачать массив файлов по ID (возвращает JSON с содержимым в base64)"""
+    """Скачать массив файлов по ID (возвращает JSON с содержимым в base64, потоково)"""
     try:
-        files_data = []
-        errors = []
+        found_files, errors = _find_batch_files(db, request.file_ids)
+        
+        return StreamingResponse(
+            _iter_batch_download(found_files, errors),
+            media_type="application/json"
+        )
+
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to batch download files: {str(e)}"
+        )
+
+def _find_batch_files(db: Session, file_ids: List[str]):
+    """
+    Найти файлы batch-запроса в БД одним запросом: (найденные файлы, ошибки по остальным)
+
+    Ошибки - пары (позиция в file_ids, ошибка): ошибки чтения при отдаче
+    добавляются позже, а в ответ все попадают в порядке запроса (_ordered_errors).
+    """
+    found_files = []
+    errors = []
+    
+    file_uuids = {}
+    invalid_ids = {}
+    for file_id in file_ids:
+        try:
+            file_uuids[file_id] = UUID(file_id)
+        except Exception as e:
+            invalid_ids[file_id] = str(e)
+    
+    db_files = crud.get_files_by_ids(db, list(set(file_uuids.values())))
+    
+    for idx, file_id in enumerate(file_ids):
+        file_uuid = file_uuids.get(file_id)
+        if file_uuid is None:
+            errors.append((idx, {
+                "file_id": file_id,
+                "error": invalid_ids[file_id]
+            }))
+            continue
         
-        for file_id in request.file_ids:
+        db_file = db_files.get(file_uuid)
+        if not db_file:
+            errors.append((idx, {
+                "file_id": file_id,
+                "error": "File not found"
+            }))
+            continue
+        
+        found_files.append({
+            "index": idx,
+            "file_id": file_id,
+            "file_name": db_file.file_name,
+            "mime_type": db_file.mime_type,
+            "file_path": db_file.file_path
+        })
+    
+    return found_files, errors
+
+def _ordered_errors(errors: List[tuple]) -> Optional[List[dict]]:
+    """Ошибки batch-download в порядке file_ids запроса (None, если ошибок нет)"""
+    if not errors:
+        return None
+    return [error for _, error in sorted(errors, key=lambda item: item[0])]
+
+def _iter_batch_download(found_files: List[dict], errors: List[tuple]):
+    """
+    Ответ batch-download по частям: файлы читаются и кодируются в base64
+    блоками, поэтому в памяти один блок, а не содержимое всех файлов
+
+    Если файл перестал читаться посреди отдачи, его объект закрывается с полем
+    "error" (content неполный), файл не входит в total и попадает в errors -
+    JSON ответа остаётся корректным.
+    """
+    yield b'{"files": ['
+    written = 0
+    total = 0
+    
+    for found in found_files:
+        try:
+            f = storage_service.open_file(found["file_path"])
+        except Exception as e:
+            errors.append((found["index"], {
+                "file_id": found["file_id"],
+                "error": str(e)
+            }))
+            continue
+        
+        with f:
+            metadata = json.dumps({
+                "file_id": found["file_id"],
+                "file_name": found["file_name"],
+                "mime_type": found["mime_type"],
+                "file_size": os.fstat(f.fileno()).st_size
+            })
+            # content дописывается в тот же объект после метаданных
+            yield (b', ' if written else b'') + metadata[:-1].encode() + b', "content": "'
+            written += 1
+            
             try:
-                file_uuid = UUID(file_id)
-                db_file = crud.get_file_by_id(db, file_uuid)
-                
-                if not db_file:
-                    errors.append({
-                        "file_id": file_id,
-                        "error": "File not found"
-                    })
-                    continue
-                
-                file_content = storage_service.read_file_content(db_file.file_path)
-                
-                # Конвертируем bytes в base64 для передачи через JSON
-                content_base64 = base64.b64encode(file_content).decode('utf-8')
-                
-                files_data.append({
-                    "file_id": file_id,
-                    "file_name": db_file.file_name,
-                    "content": content_base64,  # base64 encoded
-                    "mime_type": db_file.mime_type,
-                    "file_size": len(file_content)
-                })
-                
+                # Блоки кратны 3 байтам: base64 блоков склеивается без padding внутри
+                while chunk := f.read(BASE64_CHUNK_SIZE):
+                    yield base64.b64encode(chunk)
             except Exception as e:
-                errors.append({
-                    "file_id": file_id,
-                    "error": str(e)
-                })
+                error = {
+                    "file_id": found["file_id"],
+                    "error": f"Failed to read file: {str(e)}"
+                }
+                errors.append((found["index"], error))
+                yield b'", "error": ' + json.dumps(error["error"]).encode() + b'}'
+                continue
+            
+            yield b'"}'
+        total += 1
+    
+    yield b'], "total": %d, "failed": %d, "errors": %s}' % (
+        total,
+        len(errors),
+        json.dumps(_ordered_errors(errors)).encode()
+    )
+
+@router.post("/batch-download-zip")
+async def batch_download_files_zip(
+    request: BatchDownloadRequest = Body(...),
+    db: Session = Depends(get_db)
+):
+    """
+    Скачать массив файлов по ID одним zip архивом (без base64)
+    
+    Файлы лежат в архиве как {file_id}/{file_name} без сжатия (ZIP_STORED),
+    метаданные и ошибки - в manifest.json в конце архива.
+    """
+    try:
+        found_files, errors = _find_batch_files(db, request.file_ids)
         
-        return {
-            "files": files_data,
-            "total": len(files_data),
-            "failed": len(errors),
-            "errors": errors if errors else None
-        }
+        return StreamingResponse(
+            _iter_batch_download_zip(found_files, errors),
+            media_type="application/zip",
+            headers={"Content-Disposition": 'attachment; filename="files.zip"'}
+        )
 
     except Exception as e:
         raise HTTPException(
@@ -269,6 +436,72 @@ async def batch_download_files(
             detail=f"Failed to batch download files: {str(e)}"
         )
 
+class _ZipStreamBuffer(io.RawIOBase):
+    """Приёмник для ZipFile без seek: накопленные байты забираются через take()"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def take(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def _iter_batch_download_zip(found_files: List[dict], errors: List[tuple]):
+    """zip архив batch-download по частям: в памяти один блок файла"""
+    buffer = _ZipStreamBuffer()
+    manifest = []
+    
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_STORED) as archive:
+        for found in found_files:
+            try:
+                f = storage_service.open_file(found["file_path"])
+            except Exception as e:
+                errors.append((found["index"], {
+                    "file_id": found["file_id"],
+                    "error": str(e)
+                }))
+                continue
+            
+            with f:
+                stat = os.fstat(f.fileno())
+                arcname = f"{found['file_id']}/{os.path.basename(found['file_name'])}"
+                
+                zip_info = zipfile.ZipInfo(arcname, date_time=time.localtime(stat.st_mtime)[:6])
+                zip_info.compress_type = zipfile.ZIP_STORED
+                # Размер заранее: zipfile сам включит zip64 для файлов > 2 GB
+                zip_info.file_size = stat.st_size
+                
+                with archive.open(zip_info, "w") as entry:
+                    while chunk := f.read(ZIP_CHUNK_SIZE):
+                        entry.write(chunk)
+                        yield buffer.take()
+            
+            yield buffer.take()
+            manifest.append({
+                "file_id": found["file_id"],
+                "file_name": found["file_name"],
+                "mime_type": found["mime_type"],
+                "file_size": stat.st_size,
+                "path": arcname
+            })
+        
+        archive.writestr("manifest.json", json.dumps({
+            "files": manifest,
+            "total": len(manifest),
+            "failed": len(errors),
+            "errors": _ordered_errors(errors)
+        }))
+    
+    yield buffer.take()
+
 @router.get("/{file_id}", response_model=FileResponseSchema)
 async def get_file_metadata(
     file_id: str,
@@ -304,23 +537,64 @@ async def get_file_metadata(
             detail="Invalid file_id format"
         )
 
+def _encode_cursor(db_file) -> str:
+    """Непрозрачный cursor keyset-пагинации: (created_at, id) последнего файла страницы"""
+    raw = f"{db_file.created_at.isoformat()},{db_file.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def _decode_cursor(cursor: str):
+    """Разобрать cursor из _encode_cursor: (created_at, id)"""
+    try:
+        created_at, file_id = base64.urlsafe_b64decode(cursor.encode()).decode().split(",")
+        return datetime.fromisoformat(created_at), UUID(file_id)
+    except Exception:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
+
 @router.get("/project/{project_id}", response_model=FileListResponse)
 async def get_project_files(
     project_id: str,
     skip: int = Query(0, ge=0),
     limit: Optional[int] = Query(None, ge=1, le=1000),
+    keyset: bool = Query(False),
+    cursor: Optional[str] = Query(None),
     db: Session = Depends(get_db)
 ):
-    """Получить файлы проекта с пагинацией"""
+    """
+    Получить файлы проекта с пагинацией
+
+    По умолчанию - OFFSET пагинация через skip/limit. keyset=true - keyset-пагинация
+    (новые первыми): первая страница без cursor, следующие - с next_cursor из ответа
+    (переданный cursor сам включает keyset-режим).
+    """
     try:
         project_uuid = UUID(project_id)
 
-        total = crud.count_files_by_project(db, project_uuid)
-
-        db_files = crud.get_files_by_project(db, project_uuid, skip=skip, limit=limit)
-
+        offset_mode = not keyset and cursor is None
+        if offset_mode:
+            # Страница целиком из кэша проекта: crud сбрасывает его при изменениях
+            cached = project_cache.get(project_uuid, ("page", skip, limit))
+            if cached is not None:
+                return cached
+
+        next_cursor = None
+        if offset_mode:
+            db_files, total = crud.get_files_and_total_by_project(
+                db, project_uuid, skip=skip, limit=limit
+            )
+        else:
+            total = crud.count_files_by_project(db, project_uuid)
+            page_size = limit or KEYSET_PAGE_SIZE
+            after = _decode_cursor(cursor) if cursor is not None else None
+            db_files = crud.get_files_by_project_after(db, project_uuid, page_size, after)
+            if len(db_files) == page_size:
+                next_cursor = _encode_cursor(db_files[-1])
+
+        # Данные из БД уже соответствуют схеме: model_construct без повторной валидации
         files = [
-            FileResponseSchema(
+            FileResponseSchema.model_construct(
                 id=str(f.id),
                 project_id=str(f.project_id),
                 file_name=f.file_name,
@@ -335,7 +609,10 @@ async def get_project_files(
             for f in db_files
         ]
 
-        return FileListResponse(files=files, total=total)
+        response = FileListResponse(files=files, total=total, next_cursor=next_cursor)
+        if offset_mode:
+            project_cache.set(project_uuid, ("page", skip, limit), response)
+        return response
 
     except ValueError:
         raise HTTPException(
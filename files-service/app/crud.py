@@ -1,9 +1,11 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import and_
+from sqlalchemy.orm import Session, load_only
+from sqlalchemy import and_, func, tuple_
 from uuid import UUID
-from typing import List, Optional
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
 from app.models import File, FileType
 from app.schemas import FileUploadResponse
+from app.services.cache import project_cache
 
 def create_file(
     db: Session,
@@ -31,12 +33,45 @@ def create_file(
     )
     db.add(db_file)
     db.commit()
+    invalidate_project_cache(project_id)
     db.refresh(db_file)
     return db_file
 
+def bulk_create_files(db: Session, files_data: List[dict]) -> List[File]:
+    """Создать записи о нескольких файлах в БД одним INSERT и одним commit"""
+    if not files_data:
+        return []
+
+    db_files = [File(**file_data) for file_data in files_data]
+    db.add_all(db_files)
+    db.commit()
+    for project_id in {file_data["project_id"] for file_data in files_data}:
+        invalidate_project_cache(project_id)
+
+    # После commit объекты expired: один SELECT обновляет все вместо refresh на каждый
+    file_ids = [file_data["id"] for file_data in files_data]
+    db.query(File).filter(File.id.in_(file_ids)).all()
+    return db_files
+
 def get_file_by_id(db: Session, file_id: UUID) -> Optional[File]:
-    """Получить файл по ID"""
-    return db.query(File).filter(File.id == file_id).first()
+    """Получить файл по ID (сначала из identity map сессии, без SQL при повторном чтении)"""
+    return db.get(File, file_id)
+
+def get_files_by_ids(db: Session, file_ids: List[UUID]) -> Dict[UUID, File]:
+    """Получить файлы по списку ID одним запросом: {id: File}"""
+    if not file_ids:
+        return {}
+    db_files = db.query(File).filter(File.id.in_(file_ids)).all()
+    return {db_file.id: db_file for db_file in db_files}
+
+def _project_files_query(db: Session, project_id: UUID):
+    """Запрос файлов проекта для списка: file_path не загружается"""
+    return db.query(File).options(
+        load_only(
+            File.id, File.project_id, File.file_name, File.file_type, File.file_size,
+            File.mime_type, File.checksum, File.uploaded_by, File.created_at, File.updated_at
+        )
+    ).filter(File.project_id == project_id)
 
 def get_files_by_project(
     db: Session,
@@ -45,7 +80,7 @@ def get_files_by_project(
     limit: Optional[int] = None
 ) -> List[File]:
     """Получить файлы проекта с пагинацией"""
-    query = db.query(File).filter(File.project_id == project_id)
+    query = _project_files_query(db, project_id)
 
     if skip:
         query = query.offset(skip)
@@ -55,9 +90,87 @@ def get_files_by_project(
 
     return query.all()
 
+def get_files_by_project_after(
+    db: Session,
+    project_id: UUID,
+    limit: int,
+    after: Optional[Tuple[datetime, UUID]] = None
+) -> List[File]:
+    """
+    Получить страницу файлов проекта keyset-пагинацией (новые первыми)
+
+    after - (created_at, id) последнего файла предыдущей страницы. Страница
+    читается по индексу idx_files_project_created, без сканирования OFFSET строк.
+    """
+    query = _project_files_query(db, project_id)
+
+    if after is not None:
+        query = query.filter(tuple_(File.created_at, File.id) < after)
+
+    return query.order_by(File.created_at.desc(), File.id.desc()).limit(limit).all()
+
+def _cached_project_count(project_id: UUID) -> Optional[int]:
+    """Количество файлов проекта из кэша или None, если его нет или истёк TTL"""
+    return project_cache.get(project_id, "total")
+
+def _cache_project_count(project_id: UUID, total: int) -> None:
+    """Запомнить количество файлов проекта в кэше проекта"""
+    project_cache.set(project_id, "total", total)
+
 def count_files_by_project(db: Session, project_id: UUID) -> int:
-    """Подсчитать общее количество файлов проекта"""
-    return db.query(File).filter(File.project_id == project_id).count()
+    """
+    Подсчитать общее количество файлов проекта
+
+    Результат кэшируется на PROJECT_CACHE_TTL секунд: COUNT(*) не выполняется
+    на каждый запрос списка. Создание и удаление файлов через crud сбрасывают
+    кэш проекта, поэтому в одном процессе total не отстаёт от изменений.
+    """
+    total = _cached_project_count(project_id)
+    if total is None:
+        total = db.query(func.count(File.id)).filter(File.project_id == project_id).scalar()
+        _cache_project_count(project_id, total)
+    return total
+
+def get_files_and_total_by_project(
+    db: Session,
+    project_id: UUID,
+    skip: int = 0,
+    limit: Optional[int] = None
+) -> Tuple[List[File], int]:
+    """
+    Получить страницу файлов проекта и общее количество файлов проекта
+
+    Если total нет в кэше, он берётся из count(*) OVER () в том же запросе,
+    что и страница, - без отдельного COUNT(*). Отдельный подсчёт остаётся
+    только для пустой страницы за концом списка.
+    """
+    total = _cached_project_count(project_id)
+    if total is not None:
+        return get_files_by_project(db, project_id, skip=skip, limit=limit), total
+
+    query = _project_files_query(db, project_id).add_columns(func.count().over().label("total"))
+
+    if skip:
+        query = query.offset(skip)
+
+    if limit:
+        query = query.limit(limit)
+
+    rows = query.all()
+    if rows:
+        total = rows[0].total
+        _cache_project_count(project_id, total)
+    elif not skip:
+        total = 0
+        _cache_project_count(project_id, total)
+    else:
+        total = count_files_by_project(db, project_id)
+
+    return [row.File for row in rows], total
+
+def invalidate_project_cache(project_id: UUID) -> None:
+    """Сбросить закэшированные total и страницы списка файлов проекта"""
+    project_cache.invalidate(project_id)
 
 def get_file_by_project_and_type(
     db: Session,
@@ -76,8 +189,10 @@ def delete_file(db: Session, file_id: UUID) -> bool:
     """Удалить запись о файле из БД"""
     db_file = get_file_by_id(db, file_id)
     if db_file:
+        project_id = db_file.project_id
         db.delete(db_file)
         db.commit()
+        invalidate_project_cache(project_id)
         return True
     return False
 
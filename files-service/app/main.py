@@ -1,4 +1,5 @@
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from app.api import files
 from app.database import engine, Base
@@ -18,7 +19,9 @@ app = FastAPI(
     description="File Storage and Management Service",
     version="1.0.0",
     docs_url="/docs",
-    openapi_url="/openapi.json"
+    openapi_url="/openapi.json",
+    # JSON-ответы сериализуются orjson, а не json.dumps
+    default_response_class=ORJSONResponse
 )
 
 app.add_middleware(
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Integer, DateTime, Enum as SQLEnum, BigInteger
+from sqlalchemy import Column, String, Integer, DateTime, Enum as SQLEnum, BigInteger, Index
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.sql import func
 import uuid
@@ -20,7 +20,7 @@ class File(Base):
     __tablename__ = "files"
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    project_id = Column(UUID(as_uuid=True), nullable=False, index=True)
+    project_id = Column(UUID(as_uuid=True), nullable=False)
     file_name = Column(String, nullable=False)
     file_type = Column(SQLEnum(FileType), nullable=False)
     file_path = Column(String, nullable=False, unique=True)
@@ -31,3 +31,11 @@ class File(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
+    __table_args__ = (
+        # Список файлов проекта: keyset-пагинация по (created_at, id), новые первыми
+        Index("idx_files_project_created", "project_id", created_at.desc(), id.desc()),
+        # get_file_by_project_and_type; оба составных индекса начинаются с project_id,
+        # поэтому отдельный индекс по project_id не нужен
+        Index("idx_files_project_type", "project_id", "file_type"),
+    )
+
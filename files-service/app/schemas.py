@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from typing import Optional
 from uuid import UUID
 from datetime import datetime
@@ -27,8 +27,7 @@ class FileUploadResponse(BaseModel):
     uploaded_by: Optional[str] = None
     created_at: datetime
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 class FileResponse(BaseModel):
     id: str
@@ -42,12 +41,12 @@ class FileResponse(BaseModel):
     created_at: datetime
     updated_at: Optional[datetime] = None
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 class FileListResponse(BaseModel):
     files: list[FileResponse]
     total: int
+    next_cursor: Optional[str] = None
 
 class BatchFileUploadResponse(BaseModel):
     """Response for batch file upload"""
@@ -56,6 +55,5 @@ class BatchFileUploadResponse(BaseModel):
     failed: int = 0
     errors: Optional[list[dict]] = None
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
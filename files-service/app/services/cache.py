@@ -0,0 +1,49 @@
+import time
+from typing import Any, Dict, Hashable, Optional, Tuple
+from uuid import UUID
+
+# Сколько секунд живут закэшированные total и страницы списка файлов проекта
+PROJECT_CACHE_TTL = 5.0
+
+# Пределы размера: при переполнении кэш (или записи проекта) сбрасывается целиком
+MAX_PROJECTS = 1024
+MAX_ENTRIES_PER_PROJECT = 256
+
+
+class ProjectCache:
+    """
+    Кэш в памяти процесса с TTL, сгруппированный по project_id
+
+    Данные проекта меняются только при создании и удалении файлов через crud,
+    поэтому invalidate(project_id) сбрасывает сразу все записи проекта. Между
+    процессами кэш не общий: устаревание в другом воркере ограничено TTL.
+    """
+
+    def __init__(self, ttl: float = PROJECT_CACHE_TTL):
+        self.ttl = ttl
+        # project_id -> {key: (момент истечения по time.monotonic(), значение)}
+        self._entries: Dict[UUID, Dict[Hashable, Tuple[float, Any]]] = {}
+
+    def get(self, project_id: UUID, key: Hashable) -> Optional[Any]:
+        """Значение из кэша или None, если его нет или истёк TTL"""
+        cached = self._entries.get(project_id, {}).get(key)
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+        return None
+
+    def set(self, project_id: UUID, key: Hashable, value: Any) -> None:
+        """Запомнить значение на ttl секунд"""
+        if project_id not in self._entries and len(self._entries) >= MAX_PROJECTS:
+            self._entries.clear()
+        project_entries = self._entries.setdefault(project_id, {})
+        if len(project_entries) >= MAX_ENTRIES_PER_PROJECT:
+            project_entries.clear()
+        project_entries[key] = (time.monotonic() + self.ttl, value)
+
+    def invalidate(self, project_id: UUID) -> None:
+        """Сбросить все записи проекта"""
+        self._entries.pop(project_id, None)
+
+
+# Общий кэш total и страниц списка файлов проекта
+project_cache = ProjectCache()
@@ -1,62 +1,54 @@
 import os
 import hashlib
-import shutil
 from pathlib import Path
 from typing import BinaryIO, Tuple
 from uuid import UUID
 from fastapi import UploadFile, HTTPException, status
+from starlette.concurrency import run_in_threadpool
 from app.core.config import get_settings
 
 settings = get_settings()
 
+# Размер блока при записи загруженного файла
+COPY_CHUNK_SIZE = 1024 * 1024
+
 class StorageService:
     def __init__(self):
         self.storage_path = Path(settings.STORAGE_PATH)
         self.max_file_size = settings.MAX_FILE_SIZE
 
+        # Допустимые расширения по file_type собираются один раз, а не на каждый файл
+        image_extensions = settings.ALLOWED_IMAGE_EXTENSIONS | settings.ALLOWED_RAW_EXTENSIONS
+        self.allowed_extensions = {
+            "JSON_SCHEMA": settings.ALLOWED_JSON_EXTENSIONS,
+            "XSD_SCHEMA": settings.ALLOWED_XSD_EXTENSIONS,
+            "TEST_DATA": settings.ALLOWED_TEST_DATA_EXTENSIONS,
+            "VM_TEMPLATE": settings.ALLOWED_VM_EXTENSIONS,
+            "IMAGE": image_extensions,
+            "ANALYSIS_ORIGINAL": image_extensions,
+            "ANALYSIS_RESULT": settings.ALLOWED_ANALYSIS_RESULT_EXTENSIONS,
+            "ANALYSIS_PREVIEW": settings.ALLOWED_ANALYSIS_PREVIEW_EXTENSIONS,
+            "ANALYSIS_ARCHIVE": settings.ALLOWED_ANALYSIS_ARCHIVE_EXTENSIONS,
+        }
+
     def _ensure_project_directory(self, project_id: UUID) -> Path:
         """Создать директорию для проекта если её нет"""
         project_dir = self.storage_path / str(project_id)
         project_dir.mkdir(parents=True, exist_ok=True)
         return project_dir
 
-    def _calculate_checksum(self, file_path: Path) -> str:
-        """Вычислить MD5 хэш файла"""
-        md5_hash = hashlib.md5()
-        with open(file_path, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                md5_hash.update(chunk)
-        return md5_hash.hexdigest()
-
-    def _validate_file_size(self, file: UploadFile) -> None:
-        """Проверить размер файла"""
-        file.file.seek(0, 2)
-        file_size = file.file.tell()
-        file.file.seek(0)
-
-        if file_size > self.max_file_size:
-            raise HTTPException(
-                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
-                detail=f"File size exceeds maximum allowed size of {self.max_file_size} bytes"
-            )
+    def _file_too_large(self) -> HTTPException:
+        """Ошибка 413 о превышении MAX_FILE_SIZE"""
+        return HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"File size exceeds maximum allowed size of {self.max_file_size} bytes"
+        )
 
     def _validate_file_extension(self, filename: str, file_type: str) -> None:
         """Проверить расширение файла"""
         file_ext = Path(filename).suffix.lower()
 
-        allowed_extensions = {
-            "JSON_SCHEMA": settings.ALLOWED_JSON_EXTENSIONS,
-            "XSD_SCHEMA": settings.ALLOWED_XSD_EXTENSIONS,
-            "TEST_DATA": settings.ALLOWED_TEST_DATA_EXTENSIONS,
-            "VM_TEMPLATE": settings.ALLOWED_VM_EXTENSIONS,
-            "IMAGE": settings.ALLOWED_IMAGE_EXTENSIONS.union(settings.ALLOWED_RAW_EXTENSIONS),
-            "ANALYSIS_ORIGINAL": settings.ALLOWED_IMAGE_EXTENSIONS.union(settings.ALLOWED_RAW_EXTENSIONS),
-            "ANALYSIS_RESULT": settings.ALLOWED_ANALYSIS_RESULT_EXTENSIONS,
-            "ANALYSIS_PREVIEW": settings.ALLOWED_ANALYSIS_PREVIEW_EXTENSIONS,
-            "ANALYSIS_ARCHIVE": settings.ALLOWED_ANALYSIS_ARCHIVE_EXTENSIONS,
-        }
-
-        if file_ext not in allowed_extensions.get(file_type, set()):
+        if file_ext not in self.allowed_extensions.get(file_type, frozenset()):
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail=f"Invalid file extension '{file_ext}' for file type {file_type}"
@@ -70,7 +62,10 @@ class StorageService:
         file_id: UUID
     ) -> Tuple[str, int, str]:
         """Сохранить файл на диск"""
-        self._validate_file_size(file)
+        # Размер, известный из multipart, проверяем сразу; иначе лимит
+        # соблюдается при записи (без seek/tell по всему временному файлу)
+        if file.size is not None and file.size > self.max_file_size:
+            raise self._file_too_large()
         self._validate_file_extension(file.filename, file_type)
 
         project_dir = self._ensure_project_directory(project_id)
@@ -79,19 +74,41 @@ class StorageService:
         unique_filename = f"{file_id}{file_extension}"
         file_path = project_dir / unique_filename
 
+        # Запись и checksum - блокирующий I/O: в пуле потоков, чтобы не держать
+        # event loop и чтобы несколько файлов batch-запроса писались параллельно
+        return await run_in_threadpool(self._write_file, file, file_path)
+
+    def _write_file(self, file: UploadFile, file_path: Path) -> Tuple[str, int, str]:
+        """
+        Записать загруженный файл на диск, считая размер и checksum за тот же проход
+
+        Данные читаются один раз: каждый блок сразу идёт и в хэш, и в файл,
+        без повторного чтения записанного файла с диска. Как только записано
+        больше MAX_FILE_SIZE, частичный файл удаляется и возвращается 413.
+        """
+        checksum_hash = hashlib.new(settings.CHECKSUM_ALGORITHM)
+        file_size = 0
+
         try:
             with open(file_path, "wb") as buffer:
-                shutil.copyfileobj(file.file, buffer)
+                while chunk := file.file.read(COPY_CHUNK_SIZE):
+                    file_size += len(chunk)
+                    if file_size > self.max_file_size:
+                        break
+                    checksum_hash.update(chunk)
+                    buffer.write(chunk)
         except Exception as e:
+            file_path.unlink(missing_ok=True)
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail=f"Failed to save file: {str(e)}"
             )
 
-        file_size = file_path.stat().st_size
-        checksum = self._calculate_checksum(file_path)
+        if file_size > self.max_file_size:
+            file_path.unlink(missing_ok=True)
+            raise self._file_too_large()
 
-        return str(file_path), file_size, checksum
+        return str(file_path), file_size, checksum_hash.hexdigest()
 
     def get_file_path(self, file_path_str: str) -> Path:
         """Получить Path объект для файла"""
@@ -105,6 +122,16 @@ class StorageService:
 
         return file_path
 
+    def stat_file(self, file_path_str: str) -> os.stat_result:
+        """stat файла одним вызовом (вместо exists() и повторного stat при отдаче)"""
+        try:
+            return os.stat(file_path_str)
+        except FileNotFoundError:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="File not found on disk"
+            )
+
     def delete_file(self, file_path_str: str) -> bool:
         """Удалить файл с диска"""
         try:
@@ -119,16 +146,14 @@ class StorageService:
                 detail=f"Failed to delete file: {str(e)}"
             )
 
-    def read_file_content(self, file_path_str: str) -> bytes:
-        """Прочитать содержимое файла"""
+    def open_file(self, file_path_str: str) -> BinaryIO:
+        """Открыть файл на чтение (для потоковой отдачи без чтения целиком)"""
         file_path = self.get_file_path(file_path_str)
 
         try:
-            with open(file_path, "rb") as f:
-                return f.read()
+            return open(file_path, "rb")
         except Exception as e:
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail=f"Failed to read file: {str(e)}"
             )
-
@@ -1,3 +1,4 @@
+from functools import lru_cache
 from pydantic_settings import BaseSettings
 from pathlib import Path
 
@@ -33,6 +34,7 @@ class Settings(BaseSettings):
         env_file = ".env"
         case_sensitive = False
 
+@lru_cache(maxsize=1)
 def get_settings() -> Settings:
     return Settings()
 